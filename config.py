@@ -19,11 +19,11 @@ class Config:
     CONSECUTIVE_ABSENCE_LIMIT = 3
     
     # Reminder Settings
-    REMINDER_INTERVAL_HOURS = 24  # Send reminders every 24 hours
     REMINDER_TIME = time(10, 0)  # 10:00 AM
     
-    # Commands not counted in daily limit
-    EXEMPT_COMMANDS = [
+    # Commands not counted in daily limit (frozenset for O(1) membership checks;
+    # strip any "@botname" suffix from a command before looking it up)
+    EXEMPT_COMMANDS = frozenset({
         '/mytarget',
         '/complete',
         '/addoff',
@@ -34,7 +34,7 @@ class Config:
         '/setlimit',
         '/help',
         '/start'
-    ]
+    })
     
     # Group settings
     GROUP_LINK = os.getenv('GROUP_LINK', 'https://t.me/your_group_link')
@@ -1,13 +1,164 @@
+import asyncio
 import os
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from pymongo import MongoClient, ASCENDING, DESCENDING
-from pymongo.errors import PyMongoError, DuplicateKeyError
+from itertools import groupby
+from operator import itemgetter
+from datetime import datetime, timedelta, time
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 from bson import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
+from motor.motor_asyncio import AsyncIOMotorClient
+
+# Indexes that have been superseded by compound indexes in _create_indexes
+OBSOLETE_INDEXES = {
+    "targets": [
+        "status_1", "user_id_1", "status_1_created_at_-1", "created_at_-1",
+        "user_id_1_status_1_completed_at_-1", "user_id_1_created_at_-1",
+        "user_id_1_status_1_created_at_-1", "user_id_1_status_1_completed_day_1",
+    ],
+    "registrations": ["group_id_1", "user_id_1", "user_id_1_group_id_1"],
+    "daily_activity": ["date_1", "user_id_1", "user_id_1_date_1"],
+}
+
+# Connection pool bounds; override per deployment to match handler concurrency
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "20"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "2"))
+
+# Days of daily_activity history MongoDB keeps before its TTL monitor removes them
+DAILY_ACTIVITY_RETENTION_DAYS = 90
+
+# Seconds a registration lookup is reused before going back to MongoDB
+REGISTRATION_CACHE_TTL = 60
+
+# Seconds an is_user_registered answer is reused; registration writes invalidate it
+REGISTERED_CACHE_TTL = 300
+
+# Seconds computed user stats are reused; target writes invalidate them early
+STATS_CACHE_TTL = 30
+
+# Seconds a user_stats snapshot lives before MongoDB expires it and the next
+# read rebuilds it from targets, healing any drift from incremental updates
+USER_STATS_SNAPSHOT_TTL = 24 * 60 * 60
+
+# Counter document _id prefix; one counter per user in the counters collection
+TARGET_SEQUENCE_PREFIX = "target_seq_"
+
+# Turns a user's completed targets into streak runs: one row per distinct
+# completed_day, each day flagged when it doesn't follow the previous one,
+# a running sum of those flags to number the runs, then the run lengths.
+# Yields a single {best, last, current} document, where last/current
+# describe the newest run.
+STREAK_PIPELINE = [
+    {"$match": {"status": "completed", "completed_day": {"$ne": None}}},
+    {"$group": {"_id": "$completed_day"}},
+    {"$setWindowFields": {
+        "sortBy": {"_id": ASCENDING},
+        "output": {"prev": {"$shift": {"output": "$_id", "by": -1}}}
+    }},
+    {"$set": {"starts_run": {"$cond": [{"$eq": [{"$subtract": ["$_id", "$prev"]}, 1]}, 0, 1]}}},
+    {"$setWindowFields": {
+        "sortBy": {"_id": ASCENDING},
+        "output": {"run": {"$sum": "$starts_run", "window": {"documents": ["unbounded", "current"]}}}
+    }},
+    {"$group": {"_id": "$run", "length": {"$sum": 1}, "last": {"$max": "$_id"}}},
+    {"$sort": {"last": DESCENDING}},
+    {"$group": {
+        "_id": None,
+        "best": {"$max": "$length"},
+        "last": {"$first": "$last"},
+        "current": {"$first": "$length"}
+    }}
+]
+
+# Server error code for a change stream opened without a replica set
+CHANGE_STREAM_UNSUPPORTED_CODE = 40573
+
+# Longest wait, in seconds, between attempts to reopen the registration change stream
+CHANGE_STREAM_MAX_BACKOFF = 60
+
+# Queued notification records are written once this many accumulate
+NOTIFICATION_FLUSH_SIZE = 100
+
+# Target statuses shown to users; positive matches can use the status index
+VISIBLE_TARGET_STATUSES = ["active", "completed"]
+
+# Fields member listings return unless the caller asks for others
+MEMBER_FIELDS = ("user_id", "username", "is_active")
+
+# Converts completed_at (ms since the epoch) into a date ordinal server-side
+MS_PER_DAY = 24 * 60 * 60 * 1000
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+# Marks a cached "no registration" result, since None is a valid value
+_MISSING = object()
+
+# BSON has no date-only type, so days are stored as datetimes at midnight
+def _day_start(day) -> datetime:
+    """Normalize a date to the midnight datetime stored in `date` fields"""
+    return datetime.combine(day, time.min)
+
+def _day_range(day) -> Dict:
+    """Build a query range matching datetimes that fall on the given day"""
+    start = _day_start(day)
+    return {"$gte": start, "$lt": start + timedelta(days=1)}
+
+def _projection(fields) -> Dict:
+    """Build a projection returning only the given fields"""
+    return {**{field: 1 for field in fields}, "_id": 0}
+
+def _oid(value) -> ObjectId:
+    """Return value as an ObjectId, parsing only when given a string"""
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+def _new_registration(user_id: int, group_id: int, username: str, now: datetime) -> Dict:
+    """Build a pending registration document"""
+    return {
+        "user_id": user_id,
+        "group_id": group_id,
+        "username": username,
+        "status": "pending",
+        "created_at": now,
+        "accepted_at": None,
+        "rules_accepted": False
+    }
+
+# One client (and so one connection pool) per URI for the whole process
+_clients: Dict[str, AsyncIOMotorClient] = {}
+
+# URIs whose indexes have already been checked by this process
+_indexed_uris = set()
+
+def _get_client(connection_string: str) -> AsyncIOMotorClient:
+    """Return the shared Motor client for a connection string"""
+    client = _clients.get(connection_string)
+    if client is None:
+        client = AsyncIOMotorClient(
+            connection_string,
+            maxPoolSize=MONGO_MAX_POOL,
+            minPoolSize=MONGO_MIN_POOL,
+            maxIdleTimeMS=60000,
+            # Generous enough that a burst of concurrent updates queues for a
+            # connection instead of failing reads that decide who gets muted
+            waitQueueTimeoutMS=10000,
+            compressors="zstd,zlib",
+            retryWrites=True,
+            w="majority",
+            readPreference="primaryPreferred",
+            appname="study_bot",
+            # Rides out a replica-set election (~12s) instead of failing lookups
+            # mid-failover; still well under the driver's 30s default
+            serverSelectionTimeoutMS=15000,
+            socketTimeoutMS=10000
+        )
+        _clients[connection_string] = client
+    return client
 
 class MongoDB:
     def __init__(self, connection_string: str):
-        self.client = MongoClient(connection_string)
+        self.connection_string = connection_string
+        self.client = _get_client(connection_string)
         self.db = self.client.study_bot
         self.targets = self.db.targets
         self.users = self.db.users
@@ -15,173 +166,374 @@ class MongoDB:
         self.registrations = self.db.registrations
         self.group_members = self.db.group_members
         self.daily_activity = self.db.daily_activity  # New collection for daily activity tracking
+        self.counters = self.db.counters  # Per-user target sequence counters
+        self.user_stats = self.db.user_stats  # Materialized per-user stats snapshots
+        self.migrations = self.db.migrations  # Markers for one-off data migrations already applied
+        
+        # Short-lived cache of registrations keyed by (user_id, group_id)
+        self._registration_cache = TTLCache(maxsize=10_000, ttl=REGISTRATION_CACHE_TTL)
+        self._registered_cache = TTLCache(maxsize=10_000, ttl=REGISTERED_CACHE_TTL)
+        self._stats_cache = TTLCache(maxsize=10_000, ttl=STATS_CACHE_TTL)
+        
+        # Notification records waiting for flush_notifications()
+        self._notification_queue: List[UpdateOne] = []
+        
+        # Index snapshot per collection, loaded once by setup()
+        self._existing_indexes: Dict[str, Dict] = {}
+    
+    async def setup(self):
+        """Prepare indexes; must be awaited once the event loop is running"""
+        # Index maintenance only needs to run once per database per process
+        if self.connection_string in _indexed_uris:
+            return
+        
+        # Open the pool and discover the topology before the first update arrives
+        try:
+            await self.client.admin.command("ping")
+        except Exception as e:
+            print(f"Note: MongoDB ping failed during setup: {e}")
+        
+        # Read every collection's indexes once; the steps below work from it
+        await self._load_existing_indexes()
         
         # Drop problematic unique index if it exists
-        self._cleanup_problematic_indexes()
+        await self._cleanup_problematic_indexes()
+        await self._drop_obsolete_indexes()
         
         # Create correct indexes
-        self._create_indexes()
+        await self._create_indexes()
+        await self._run_migrations()
+        _indexed_uris.add(self.connection_string)
+    
+    async def _load_existing_indexes(self):
+        """Snapshot the current indexes of every indexed collection"""
+        collections = [self.targets, self.registrations, self.group_members, self.user_stats, self.daily_activity]
+        snapshots = await asyncio.gather(
+            *(collection.index_information() for collection in collections),
+            return_exceptions=True
+        )
+        for collection, snapshot in zip(collections, snapshots):
+            if isinstance(snapshot, Exception):
+                print(f"Note: Could not list indexes on {collection.name}: {snapshot}")
+                snapshot = {}
+            self._existing_indexes[collection.name] = snapshot
     
-    def _cleanup_problematic_indexes(self):
+    async def _ensure_indexes(self, collection, models: List[IndexModel]):
+        """Create only the indexes the snapshot doesn't already have"""
+        existing = self._existing_indexes.get(collection.name, {})
+        missing = [model for model in models if model.document["name"] not in existing]
+        if missing:
+            await collection.create_indexes(missing)
+    
+    async def _cleanup_problematic_indexes(self):
         """Remove any problematic indexes that might cause duplicate key errors"""
         try:
-            # Get all indexes
-            indexes = list(self.targets.index_information())
+            # Reuse the snapshot taken by setup()
+            indexes = self._existing_indexes.get(self.targets.name, {})
             
-            # Look for problematic indexes
-            for index_name in indexes:
+            # Look for problematic indexes; iterate a copy so drops can update the snapshot
+            for index_name, index_info in list(indexes.items()):
                 # Drop any unique index on user_id and date/deadline
                 if index_name == 'user_id_1_date_-1' or index_name == 'user_id_1_deadline_-1':
                     try:
-                        self.targets.drop_index(index_name)
+                        await self.targets.drop_index(index_name)
+                        indexes.pop(index_name, None)
                         print(f"✅ Dropped problematic index: {index_name}")
                     except Exception as e:
                         print(f"Note: Could not drop index {index_name}: {e}")
                 
                 # Drop any compound unique index that includes user_id
-                elif '_1' in index_name and index_name != '_id_':
-                    index_info = self.targets.index_information().get(index_name, {})
-                    if index_info.get('unique'):
+                elif index_info.get('unique') is True and index_name != '_id_':
+                    if '_1' in index_name:
                         # Check if it includes user_id
                         key = index_info.get('key', [])
                         if any('user_id' in k for k in key):
                             try:
-                                self.targets.drop_index(index_name)
+                                await self.targets.drop_index(index_name)
+                                indexes.pop(index_name, None)
                                 print(f"✅ Dropped unique index: {index_name}")
                             except Exception as e:
                                 print(f"Note: Could not drop index {index_name}: {e}")
         except Exception as e:
             print(f"Error cleaning up indexes: {e}")
     
-    def _create_indexes(self):
+    async def _drop_obsolete_indexes(self):
+        """Remove indexes that are covered by a newer compound index"""
+        for collection_name, index_names in OBSOLETE_INDEXES.items():
+            collection = self.db[collection_name]
+            try:
+                existing = self._existing_indexes.get(collection_name, {})
+                for index_name in index_names:
+                    if index_name in existing:
+                        await collection.drop_index(index_name)
+                        existing.pop(index_name, None)
+                        print(f"✅ Dropped obsolete index: {collection_name}.{index_name}")
+            except Exception as e:
+                print(f"Note: Could not drop obsolete indexes on {collection_name}: {e}")
+    
+    async def _run_migrations(self):
+        """Run the one-off data migrations this database hasn't completed yet"""
+        # Both steps scan all of targets, so they run once per database, not per restart
+        steps = {
+            "backfill_completed_days": self._backfill_completed_days,
+            "seed_target_counters": self._seed_target_counters,
+        }
+        try:
+            done = {
+                marker["_id"]
+                async for marker in self.migrations.find({"_id": {"$in": list(steps)}}, {"_id": 1})
+            }
+        except Exception as e:
+            print(f"Note: Could not read migration markers: {e}")
+            return
+        
+        for name, step in steps.items():
+            if name in done or not await step():
+                continue
+            try:
+                await self.migrations.update_one(
+                    {"_id": name}, {"$set": {"completed_at": datetime.now()}}, upsert=True
+                )
+            except Exception as e:
+                print(f"Note: Could not record migration {name}: {e}")
+    
+    async def _backfill_completed_days(self) -> bool:
+        """Derive completed_day for targets completed before it was stored"""
+        try:
+            await self.targets.update_many(
+                {"status": "completed", "completed_day": {"$exists": False}, "completed_at": {"$type": "date"}},
+                [{"$set": {"completed_day": {"$add": [
+                    {"$toLong": {"$floor": {"$divide": [{"$toLong": "$completed_at"}, MS_PER_DAY]}}},
+                    EPOCH_ORDINAL
+                ]}}}]
+            )
+            return True
+        except Exception as e:
+            print(f"Note: Could not backfill completed days: {e}")
+            return False
+    
+    async def _seed_target_counters(self) -> bool:
+        """Start each user's sequence counter from their highest existing target"""
+        try:
+            # keepExisting never moves a live counter backwards
+            await self.targets.aggregate([
+                {"$match": {"sequence_number": {"$type": "number"}}},
+                {"$group": {"_id": "$user_id", "n": {"$max": "$sequence_number"}}},
+                {"$project": {"_id": {"$concat": [TARGET_SEQUENCE_PREFIX, {"$toString": "$_id"}]}, "n": 1}},
+                {"$merge": {"into": "counters", "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+            ]).to_list(length=None)
+            return True
+        except Exception as e:
+            print(f"Note: Could not seed target counters: {e}")
+            return False
+    
+    async def _next_sequence(self, user_id: int) -> int:
+        """Atomically take the next sequence number for a user"""
+        counter = await self.counters.find_one_and_update(
+            {"_id": f"{TARGET_SEQUENCE_PREFIX}{user_id}"},
+            {"$inc": {"n": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["n"]
+    
+    async def _create_indexes(self):
         """Create necessary indexes"""
-        # Create non-unique indexes for better query performance
-        self.targets.create_index([("user_id", ASCENDING)])
-        self.targets.create_index([("status", ASCENDING)])
-        self.targets.create_index([("created_at", DESCENDING)])
-        self.targets.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+        # At most one createIndexes command per collection, and none on a warm restart
+        await self._ensure_indexes(self.targets, [
+            # Covers the stats counts and the completed-day distinct from the index alone
+            IndexModel(
+                [("user_id", ASCENDING), ("status", ASCENDING), ("completed_day", ASCENDING)],
+                name="user_status_completed_day"
+            ),
+            # Equality on user and status, then the created_at sort/range
+            IndexModel(
+                [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING)],
+                name="user_status_created"
+            ),
+        ])
         
-        # Create indexes for registrations
-        self.registrations.create_index([("user_id", ASCENDING)])
-        self.registrations.create_index([("group_id", ASCENDING)])
-        self.registrations.create_index([("user_id", ASCENDING), ("group_id", ASCENDING)])
+        await self._ensure_indexes(self.registrations, [
+            # Partial index: group lookups only ever ask for accepted members
+            IndexModel(
+                [("group_id", ASCENDING), ("user_id", ASCENDING)],
+                partialFilterExpression={"status": "accepted"}
+            ),
+            IndexModel([("user_id", ASCENDING), ("group_id", ASCENDING), ("status", ASCENDING)]),
+        ])
         
-        # Create indexes for group members
-        self.group_members.create_index([("user_id", ASCENDING), ("group_id", ASCENDING)])
+        await self._ensure_indexes(self.group_members, [
+            IndexModel([("user_id", ASCENDING), ("group_id", ASCENDING)]),
+            IndexModel([("group_id", ASCENDING), ("is_active", ASCENDING)]),
+        ])
         
-        # Create indexes for daily activity
-        self.daily_activity.create_index([("user_id", ASCENDING)])
-        self.daily_activity.create_index([("date", ASCENDING)])
-        self.daily_activity.create_index([("user_id", ASCENDING), ("date", ASCENDING)])
+        await self._ensure_indexes(self.user_stats, [
+            # Snapshots expire daily and are rebuilt lazily from targets
+            IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=USER_STATS_SNAPSHOT_TTL, name="updated_at_ttl"),
+        ])
+        
+        await self._ensure_indexes(self.daily_activity, [
+            # TTL index: old days expire server-side, no cleanup job needed
+            IndexModel(
+                [("date", ASCENDING)],
+                expireAfterSeconds=DAILY_ACTIVITY_RETENTION_DAYS * 24 * 60 * 60,
+                name="date_ttl"
+            ),
+            # One document per user per day; every activity upsert seeks on it
+            IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], unique=True, name="uniq_user_date"),
+        ])
     
-    def add_target(self, target_data: Dict) -> str:
+    async def add_target(self, target_data: Dict, today: datetime.date = None) -> str:
         """Add a new study target"""
         try:
-            # Ensure target has a unique identifier for the user
-            target_data["created_at"] = datetime.now()
+            # Keep the caller's timestamp so created_at and the activity day
+            # come from one clock read and can't straddle midnight
+            target_data.setdefault("created_at", datetime.now())
+            today = today or target_data["created_at"].date()
             
             # Add a unique sequence number for this user
-            last_target = self.targets.find_one(
-                {"user_id": target_data["user_id"]},
-                sort=[("sequence_number", DESCENDING)]
-            )
+            target_data["sequence_number"] = await self._next_sequence(target_data["user_id"])
             
-            if last_target and "sequence_number" in last_target:
-                target_data["sequence_number"] = last_target["sequence_number"] + 1
-            else:
-                target_data["sequence_number"] = 1
-            
-            result = self.targets.insert_one(target_data)
+            result = await self.targets.insert_one(target_data)
             
-            # Update daily activity
-            if result.inserted_id:
-                today = datetime.now().date()
-                self.update_daily_activity(target_data["user_id"], today, has_target=True)
+            # The target is saved; the side effects touch other collections, so
+            # send them together and don't let their failure report the insert as failed
+            side_effects = await asyncio.gather(
+                self.update_daily_activity(
+                    target_data["user_id"], today, has_target=True, now=target_data["created_at"]
+                ),
+                self._invalidate_stats(target_data["user_id"]),
+                return_exceptions=True
+            )
+            for side_effect in side_effects:
+                if isinstance(side_effect, Exception):
+                    print(f"Error updating target side effects: {side_effect}")
+            self._stats_cache.pop(target_data["user_id"], None)
             
-            return str(result.inserted_id)
-        except DuplicateKeyError as e:
-            print(f"Duplicate key error: {e}")
-            # Retry with a new sequence number
-            target_data["sequence_number"] += 1
-            result = self.targets.insert_one(target_data)
             return str(result.inserted_id)
         except Exception as e:
             print(f"Error adding target: {e}")
             return None
     
-    def get_user_targets(self, user_id: int) -> List[Dict]:
-        """Get all targets for a user"""
+    async def get_user_targets(self, user_id: int, skip: int = 0, limit: int = 0) -> List[Dict]:
+        """Get a user's targets, newest first; limit=0 returns them all"""
         try:
-            targets = list(self.targets.find(
-                {"user_id": user_id, "status": {"$ne": "deleted"}}
-            ).sort("created_at", DESCENDING))
+            targets = await self.targets.find(
+                {"user_id": user_id, "status": {"$in": VISIBLE_TARGET_STATUSES}},
+                projection={"target": 1, "status": 1, "progress": 1, "deadline": 1, "created_at": 1}
+            ).hint("user_status_created").sort("created_at", DESCENDING).skip(skip).limit(limit).to_list(length=None)
             return targets
         except Exception as e:
             print(f"Error getting user targets: {e}")
             return []
     
-    def update_target_progress(self, target_id: str, progress: int) -> bool:
-        """Update target progress percentage"""
+    async def get_user_targets_for_day(self, user_id: int, day: datetime.date) -> List[Dict]:
+        """Get a user's targets created on a given day"""
         try:
-            result = self.targets.update_one(
-                {"_id": ObjectId(target_id)},
-                {"$set": {"progress": progress, "updated_at": datetime.now()}}
-            )
-            return result.modified_count > 0
+            return await self.targets.find(
+                {
+                    "user_id": user_id,
+                    "status": {"$in": VISIBLE_TARGET_STATUSES},
+                    "created_at": _day_range(day)
+                },
+                projection={"target": 1, "progress": 1, "created_at": 1}
+            ).hint("user_status_created").sort("created_at", DESCENDING).to_list(length=None)
         except Exception as e:
+            print(f"Error getting user targets for day: {e}")
+            return []
+    
+    async def update_target_progress(self, target_id: Union[ObjectId, str], progress: int) -> Optional[Dict]:
+        """Update target progress percentage and return the updated target"""
+        try:
+            return await self.targets.find_one_and_update(
+                {"_id": _oid(target_id)},
+                {"$set": {"progress": progress, "updated_at": datetime.now()}},
+                projection={"user_id": 1, "status": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        except (PyMongoError, InvalidId) as e:
             print(f"Error updating target progress: {e}")
-            return False
+            return None
     
-    def update_target_deadline(self, target_id: str, deadline: datetime) -> bool:
-        """Update target deadline"""
+    async def update_target_deadline(self, target_id: Union[ObjectId, str], deadline: datetime) -> Optional[Dict]:
+        """Update target deadline and return the updated target"""
         try:
-            result = self.targets.update_one(
-                {"_id": ObjectId(target_id)},
-                {"$set": {"deadline": deadline}}
+            return await self.targets.find_one_and_update(
+                {"_id": _oid(target_id)},
+                {"$set": {"deadline": deadline}},
+                projection={"user_id": 1, "status": 1},
+                return_document=ReturnDocument.AFTER
             )
-            return result.modified_count > 0
-        except Exception as e:
+        except (PyMongoError, InvalidId) as e:
             print(f"Error updating target deadline: {e}")
-            return False
+            return None
     
-    def complete_target(self, target_id: str) -> bool:
-        """Mark target as completed"""
+    async def complete_target(self, target_id: Union[ObjectId, str]) -> Optional[Dict]:
+        """Mark target as completed and return the updated target"""
         try:
-            result = self.targets.update_one(
-                {"_id": ObjectId(target_id)},
+            now = datetime.now()
+            # Get the owner back from the write itself to invalidate their stats
+            target = await self.targets.find_one_and_update(
+                {"_id": _oid(target_id)},
                 {"$set": {
                     "status": "completed",
                     "progress": 100,
-                    "completed_at": datetime.now()
-                }}
+                    "completed_at": now,
+                    # Day ordinal kept alongside so streaks never touch datetimes
+                    "completed_day": now.toordinal()
+                }},
+                projection={"user_id": 1, "status": 1},
+                return_document=ReturnDocument.AFTER
             )
-            return result.modified_count > 0
-        except Exception as e:
+            if target is not None:
+                # Completion can change the streaks, so rebuild on the next read
+                await self._invalidate_stats(target["user_id"])
+                self._stats_cache.pop(target["user_id"], None)
+            return target
+        except (PyMongoError, InvalidId) as e:
             print(f"Error completing target: {e}")
-            return False
+            return None
+    
+    async def _invalidate_stats(self, user_id: int):
+        """Clear a user's stats snapshot and bump its version after a target write"""
+        # The version makes a rebuild that read targets before this write
+        # fail its conditional replace instead of storing stale numbers
+        await self.user_stats.update_one(
+            {"_id": user_id},
+            {
+                "$inc": {"version": 1},
+                "$unset": {"counts": "", "streaks": ""},
+                "$set": {"updated_at": datetime.now()}
+            },
+            upsert=True
+        )
     
-    def get_user_stats(self, user_id: int) -> Dict:
+    async def get_user_stats(self, user_id: int) -> Dict:
         """Get user statistics"""
+        cached = self._stats_cache.get(user_id)
+        if cached is not None:
+            return cached
         try:
-            targets = list(self.targets.find({"user_id": user_id}))
+            snapshot = await self.user_stats.find_one({"_id": user_id})
+            stored = True
+            if snapshot is None or "counts" not in snapshot:
+                version = snapshot.get("version") if snapshot else None
+                snapshot, stored = await self._build_stats_snapshot(user_id, version)
             
-            total = len(targets)
-            completed = len([t for t in targets if t.get("status") == "completed"])
-            active = len([t for t in targets if t.get("status") == "active"])
+            counts = snapshot.get("counts", {})
+            total = sum(counts.values())
+            completed = counts.get("completed", 0)
+            active = counts.get("active", 0)
             
             completion_rate = round((completed / total * 100) if total > 0 else 0, 1)
             
-            # Calculate streak
-            completed_dates = [
-                t["completed_at"].date() 
-                for t in targets 
-                if t.get("completed_at") and t.get("status") == "completed"
-            ]
-            
-            current_streak = self._calculate_streak(completed_dates)
-            best_streak = self._calculate_best_streak(completed_dates)
+            # The newest run is still alive if it ends today or yesterday
+            streaks = snapshot.get("streaks", {})
+            best_streak = streaks.get("best", 0)
+            today = datetime.now().date().toordinal()
+            current_streak = streaks.get("current", 0) if streaks.get("last", 0) >= today - 1 else 0
             
-            return {
+            stats = {
                 "total_targets": total,
                 "completed_targets": completed,
                 "active_targets": active,
@@ -189,6 +541,10 @@ class MongoDB:
                 "current_streak": current_streak,
                 "best_streak": best_streak
             }
+            # A rebuild that lost to a concurrent write may already be stale
+            if stored:
+                self._stats_cache[user_id] = stats
+            return stats
         except Exception as e:
             print(f"Error getting user stats: {e}")
             return {
@@ -200,85 +556,77 @@ class MongoDB:
                 "best_streak": 0
             }
     
-    def _calculate_streak(self, dates: List) -> int:
-        """Calculate current streak from completed dates"""
-        if not dates:
-            return 0
-        
-        dates = sorted(set(dates), reverse=True)
-        today = datetime.now().date()
-        streak = 0
-        
-        # Check if completed today
-        if today in dates:
-            streak += 1
-        
-        # Check consecutive days
-        for i in range(1, len(dates)):
-            if (dates[i-1] - dates[i]).days == 1:
-                streak += 1
-            else:
-                break
-        
-        return streak
-    
-    def _calculate_best_streak(self, dates: List) -> int:
-        """Calculate best streak from completed dates"""
-        if not dates:
-            return 0
-        
-        dates = sorted(set(dates))
-        best_streak = 1
-        current_streak = 1
+    async def _build_stats_snapshot(self, user_id: int, version: Optional[int]) -> Tuple[Dict, bool]:
+        """Recompute a user's stats from their targets; return it and whether it was stored"""
+        # One round-trip: status counts and the streak runs are computed
+        # side by side on the server, so no per-day data comes back
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$project": {"_id": 0, "status": 1, "completed_day": 1}},
+            {"$facet": {
+                "counts": [
+                    {"$group": {"_id": "$status", "n": {"$sum": 1}}}
+                ],
+                "streaks": STREAK_PIPELINE
+            }}
+        ]
+        result = await self.targets.aggregate(pipeline, hint="user_status_completed_day").to_list(length=1)
+        facets = result[0] if result else {}
         
-        for i in range(1, len(dates)):
-            if (dates[i] - dates[i-1]).days == 1:
-                current_streak += 1
-                best_streak = max(best_streak, current_streak)
-            else:
-                current_streak = 1
-        
-        return best_streak
+        snapshot = {
+            "counts": {c["_id"]: c["n"] for c in facets.get("counts", []) if c["_id"]},
+            "streaks": facets["streaks"][0] if facets.get("streaks") else {},
+            "version": version,
+            "updated_at": datetime.now()
+        }
+        try:
+            # Only store it if no target write bumped the version meanwhile;
+            # otherwise the upsert collides on _id and the snapshot is dropped
+            await self.user_stats.replace_one({"_id": user_id, "version": version}, snapshot, upsert=True)
+        except DuplicateKeyError:
+            return snapshot, False
+        return snapshot, True
     
     # Registration methods
-    def add_registration(self, user_id: int, group_id: int, username: str) -> str:
+    def _invalidate_registration(self, user_id: int, group_id: int):
+        """Drop cached registration lookups for a user after a write"""
+        self._registration_cache.pop((user_id, group_id), None)
+        self._registered_cache.pop((user_id, group_id), None)
+    
+    async def add_registration(self, user_id: int, group_id: int, username: str) -> str:
         """Add a new registration request"""
         try:
-            registration_data = {
-                "user_id": user_id,
-                "group_id": group_id,
-                "username": username,
-                "status": "pending",
-                "created_at": datetime.now(),
-                "accepted_at": None,
-                "rules_accepted": False
-            }
-            result = self.registrations.insert_one(registration_data)
+            result = await self.registrations.insert_one(
+                _new_registration(user_id, group_id, username, datetime.now())
+            )
+            self._invalidate_registration(user_id, group_id)
             return str(result.inserted_id)
         except Exception as e:
             print(f"Error adding registration: {e}")
             return None
     
-    def update_registration_status(self, user_id: int, group_id: int, status: str) -> bool:
+    async def update_registration_status(self, user_id: int, group_id: int, status: str) -> bool:
         """Update registration status"""
         try:
             update_data = {
                 "status": status,
                 "accepted_at": datetime.now() if status == "accepted" else None
             }
-            result = self.registrations.update_one(
+            result = await self.registrations.update_one(
                 {"user_id": user_id, "group_id": group_id},
                 {"$set": update_data}
             )
+            # Invalidate after the write so a concurrent lookup can't re-cache the old state
+            self._invalidate_registration(user_id, group_id)
             return result.modified_count > 0
-        except Exception as e:
+        except PyMongoError as e:
             print(f"Error updating registration status: {e}")
             return False
     
-    def accept_rules(self, user_id: int, group_id: int) -> bool:
+    async def accept_rules(self, user_id: int, group_id: int) -> bool:
         """Mark rules as accepted"""
         try:
-            result = self.registrations.update_one(
+            result = await self.registrations.update_one(
                 {"user_id": user_id, "group_id": group_id},
                 {"$set": {
                     "rules_accepted": True,
@@ -286,32 +634,104 @@ class MongoDB:
                     "accepted_at": datetime.now()
                 }}
             )
+            self._invalidate_registration(user_id, group_id)
             return result.modified_count > 0
-        except Exception as e:
+        except PyMongoError as e:
             print(f"Error accepting rules: {e}")
             return False
     
-    def get_registration_status(self, user_id: int, group_id: int) -> Optional[Dict]:
+    async def watch_registrations(self):
+        """Invalidate cached registration lookups as soon as MongoDB reports a change"""
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        resume_token = None
+        delay = 1
+        while True:
+            try:
+                async with self.registrations.watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    delay = 1
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change.get("fullDocument")
+                        if document:
+                            self._invalidate_registration(document.get("user_id"), document.get("group_id"))
+                        else:
+                            # Deletes only carry the _id, so forget everything
+                            self._clear_registration_caches()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED_CODE:
+                    # Change streams need a replica set; the TTLs still bound staleness
+                    print(f"Note: Registration change stream unavailable: {e}")
+                    return
+                # The resume point may have aged out of the oplog; start afresh
+                resume_token = None
+                print(f"Error watching registrations, retrying in {delay}s: {e}")
+            except PyMongoError as e:
+                print(f"Error watching registrations, retrying in {delay}s: {e}")
+            
+            # Changes may have been missed while disconnected
+            self._clear_registration_caches()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, CHANGE_STREAM_MAX_BACKOFF)
+    
+    def _clear_registration_caches(self):
+        """Forget every cached registration lookup"""
+        self._registration_cache.clear()
+        self._registered_cache.clear()
+    
+    async def get_registration_status(self, user_id: int, group_id: int) -> Optional[Dict]:
         """Get registration status for a user in a group"""
+        key = (user_id, group_id)
+        cached = self._registration_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
         try:
-            return self.registrations.find_one({
+            registration = await self.registrations.find_one({
                 "user_id": user_id, 
                 "group_id": group_id
             })
+            self._registration_cache[key] = registration
+            return registration
         except Exception as e:
             print(f"Error getting registration status: {e}")
             return None
     
-    def is_user_registered(self, user_id: int, group_id: int) -> bool:
-        """Check if user is registered and accepted"""
-        registration = self.get_registration_status(user_id, group_id)
-        return registration and registration.get("status") == "accepted"
+    async def is_user_registered(self, user_id: int, group_id: int) -> Optional[bool]:
+        """Check if user is registered and accepted; None when the lookup failed"""
+        key = (user_id, group_id)
+        registered = self._registered_cache.get(key)
+        if registered is not None:
+            return registered
+        registration = self._registration_cache.get(key, _MISSING)
+        if registration is not _MISSING:
+            return bool(registration) and registration.get("status") == "accepted"
+        try:
+            # Let the server answer from the index instead of shipping the document
+            registered = await self.registrations.count_documents(
+                {"user_id": user_id, "group_id": group_id, "status": "accepted"},
+                limit=1
+            ) > 0
+            self._registered_cache[key] = registered
+            return registered
+        except PyMongoError as e:
+            # Unknown isn't unregistered: callers decide whether to act on it
+            print(f"Error checking registration: {e}")
+            return None
+    
+    async def count_registered_users(self, group_id: int) -> Optional[int]:
+        """Count a group's accepted registrations; None when the count failed"""
+        try:
+            return await self.registrations.count_documents({"group_id": group_id, "status": "accepted"})
+        except PyMongoError as e:
+            print(f"Error counting registered users: {e}")
+            return None
     
     # Group member tracking methods
-    def add_group_member(self, user_id: int, group_id: int, username: str):
+    async def add_group_member(self, user_id: int, group_id: int, username: str):
         """Add or update group member"""
         try:
-            self.group_members.update_one(
+            await self.group_members.update_one(
                 {"user_id": user_id, "group_id": group_id},
                 {"$set": {
                     "username": username,
@@ -323,140 +743,286 @@ class MongoDB:
         except Exception as e:
             print(f"Error adding group member: {e}")
     
-    def get_all_group_members(self, group_id: int) -> List[Dict]:
+    async def get_all_group_members(self, group_id: int, fields=MEMBER_FIELDS) -> List[Dict]:
         """Get all members in a group"""
         try:
-            return list(self.group_members.find({"group_id": group_id}))
+            return await self.group_members.find(
+                {"group_id": group_id},
+                projection=_projection(fields)
+            ).to_list(length=None)
         except Exception as e:
             print(f"Error getting group members: {e}")
             return []
     
-    def check_and_register_existing_members(self, group_id: int, context) -> List[Dict]:
+    async def get_members_for_groups(self, group_ids: List[int], fields=MEMBER_FIELDS) -> Dict[int, List[Dict]]:
+        """Get members of several groups in one query, keyed by group_id"""
+        try:
+            members = await self.group_members.find(
+                {"group_id": {"$in": group_ids}},
+                projection=_projection(("group_id",) + tuple(fields))
+            ).sort("group_id", ASCENDING).to_list(length=None)
+            return {
+                group_id: list(group)
+                for group_id, group in groupby(members, key=itemgetter("group_id"))
+            }
+        except Exception as e:
+            print(f"Error getting members for groups: {e}")
+            return {}
+    
+    async def check_and_register_existing_members(self, group_id: int, context) -> List[Dict]:
         """Check existing members and register those who aren't"""
         try:
             # Get all chat members
-            chat_members = context.bot.get_chat_administrators(group_id)
-            member_ids = [member.user.id for member in chat_members]
-            
-            unregistered_members = []
-            for member_id in member_ids:
-                if member_id == context.bot.id:
-                    continue
-                    
-                if not self.is_user_registered(member_id, group_id):
-                    # Add to registration database
-                    registration = self.get_registration_status(member_id, group_id)
-                    if not registration:
-                        member_info = next((m for m in chat_members if m.user.id == member_id), None)
-                        if member_info:
-                            username = member_info.user.username or member_info.user.first_name
-                            registration_id = self.add_registration(member_id, group_id, username)
-                        else:
-                            registration_id = None
-                    else:
-                        registration_id = str(registration.get("_id")) if registration.get("_id") else None
-                    
-                    unregistered_members.append({
-                        "user_id": member_id,
-                        "registration_id": registration_id
-                    })
-            
-            return unregistered_members
+            chat_members = await context.bot.get_chat_administrators(group_id)
+            usernames = {
+                m.user.id: m.user.username or m.user.first_name
+                for m in chat_members if m.user.id != context.bot.id
+            }
+            return await self._register_missing(group_id, usernames)
         except Exception as e:
             print(f"Error checking existing members: {e}")
             return []
     
+    async def add_new_members(self, group_id: int, usernames: Dict[int, str]) -> Optional[List[Dict]]:
+        """Track members who just joined and register those who aren't"""
+        try:
+            now = datetime.now()
+            tracked = self.group_members.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "group_id": group_id},
+                    {"$set": {"username": username, "last_seen": now, "is_active": True}},
+                    upsert=True
+                )
+                for user_id, username in usernames.items()
+            ], ordered=False)
+            # Membership tracking is best-effort; its failure must not hold back registration
+            tracking, unregistered_members = await asyncio.gather(
+                tracked, self._register_missing(group_id, usernames, now),
+                return_exceptions=True
+            )
+            if isinstance(tracking, Exception):
+                print(f"Error tracking new members: {tracking}")
+            if isinstance(unregistered_members, Exception):
+                raise unregistered_members
+            return unregistered_members
+        except Exception as e:
+            print(f"Error adding new members: {e}")
+            return None
+    
+    async def _register_missing(self, group_id: int, usernames: Dict[int, str], now: datetime = None) -> List[Dict]:
+        """Create pending registrations for users without an accepted one"""
+        # Fetch every existing registration in one query
+        existing = {}
+        async for registration in self.registrations.find(
+            {"group_id": group_id, "user_id": {"$in": list(usernames)}},
+            {"user_id": 1, "status": 1}
+        ):
+            existing[registration["user_id"]] = registration
+        
+        now = now or datetime.now()
+        ops = []
+        unregistered_members = []
+        for member_id, username in usernames.items():
+            registration = existing.get(member_id)
+            if registration and registration.get("status") == "accepted":
+                continue
+            
+            # Hand the username back so callers don't have to look
+            # each member up again through the Bot API
+            member = {
+                "user_id": member_id,
+                "username": username,
+                "registration_id": str(registration["_id"]) if registration else None
+            }
+            if not registration:
+                # Upsert so a registration created meanwhile is left untouched
+                member["op_index"] = len(ops)
+                ops.append(UpdateOne(
+                    {"user_id": member_id, "group_id": group_id},
+                    {"$setOnInsert": _new_registration(member_id, group_id, username, now)},
+                    upsert=True
+                ))
+            unregistered_members.append(member)
+        
+        if ops:
+            result = await self.registrations.bulk_write(ops, ordered=False)
+            for member in unregistered_members:
+                if "op_index" in member:
+                    upserted_id = result.upserted_ids.get(member.pop("op_index"))
+                    member["registration_id"] = str(upserted_id) if upserted_id else None
+                self._invalidate_registration(member["user_id"], group_id)
+        
+        return unregistered_members
+    
     # Daily activity tracking methods
-    def update_daily_activity(self, user_id: int, date: datetime.date, has_target: bool = False):
+    async def update_daily_activity(self, user_id: int, date: datetime.date, has_target: bool = False, now: datetime = None):
         """Update daily activity for a user"""
         try:
-            activity_data = {
-                "user_id": user_id,
-                "date": date,
-                "has_target_today": has_target,
-                "last_updated": datetime.now(),
-                "notifications_sent": [],
-                "marked_absent": False,
-                "absent_reason": ""
-            }
-            
-            self.daily_activity.update_one(
-                {"user_id": user_id, "date": date},
-                {"$set": activity_data},
+            # Defaults are only written when the day's document is created,
+            # so a single upsert never wipes reminders already recorded today
+            await self.daily_activity.update_one(
+                {"user_id": user_id, "date": _day_start(date)},
+                {
+                    "$set": {
+                        "has_target_today": has_target,
+                        "last_updated": now or datetime.now()
+                    },
+                    "$setOnInsert": {
+                        "notifications_sent": [],
+                        "marked_absent": False,
+                        "absent_reason": ""
+                    }
+                },
                 upsert=True
             )
         except Exception as e:
             print(f"Error updating daily activity: {e}")
     
-    def get_users_without_target_today(self, date: datetime.date) -> List[Dict]:
+    async def get_users_without_target_today(self, date: datetime.date, group_id: int) -> List[Dict]:
         """Get all users who haven't set a target today"""
         try:
-            # Get all registered users for the group
-            registered_users = list(self.registrations.find(
-                {"group_id": int(ALLOWED_GROUP_ID), "status": "accepted"}
-            ))
-            
-            users_without_target = []
-            for user in registered_users:
-                user_id = user["user_id"]
-                
-                # Check if user has target today
-                activity = self.daily_activity.find_one(
-                    {"user_id": user_id, "date": date}
-                )
-                
-                if not activity or not activity.get("has_target_today", False):
-                    users_without_target.append({
-                        "user_id": user_id,
-                        "username": user.get("username", "Unknown"),
-                        "notifications_sent": activity.get("notifications_sent", []) if activity else []
-                    })
+            # Join each accepted registration with its activity for the day
+            # so the whole check is a single round-trip
+            pipeline = [
+                {"$match": {"group_id": group_id, "status": "accepted"}},
+                {"$lookup": {
+                    "from": "daily_activity",
+                    "let": {"uid": "$user_id"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$and": [
+                            {"$eq": ["$user_id", "$$uid"]},
+                            {"$eq": ["$date", _day_start(date)]}
+                        ]}}},
+                        {"$project": {"_id": 0, "has_target_today": 1, "notifications_sent": 1}}
+                    ],
+                    "as": "activity"
+                }},
+                {"$match": {"activity.has_target_today": {"$ne": True}}},
+                # Shape the result on the server so only the needed fields travel back
+                {"$project": {
+                    "_id": 0,
+                    "user_id": 1,
+                    "username": {"$ifNull": ["$username", "Unknown"]},
+                    "notifications_sent": {"$ifNull": [
+                        {"$arrayElemAt": ["$activity.notifications_sent", 0]}, []
+                    ]}
+                }}
+            ]
             
-            return users_without_target
+            return await self.registrations.aggregate(pipeline).to_list(length=None)
         except Exception as e:
             print(f"Error getting users without target: {e}")
             return []
     
-    def record_notification_sent(self, user_id: int, date: datetime.date, notification_type: str):
-        """Record that a notification was sent to a user"""
+    async def get_daily_attendance(self, group_id: int, date: datetime.date) -> List[Dict]:
+        """Get every accepted member's attendance for a day in one aggregation"""
         try:
-            self.daily_activity.update_one(
-                {"user_id": user_id, "date": date},
-                {
-                    "$push": {"notifications_sent": {
-                        "type": notification_type,
-                        "sent_at": datetime.now()
-                    }},
-                    "$set": {"last_notification": datetime.now()}
-                },
-                upsert=True
-            )
+            day = _day_start(date)
+            pipeline = [
+                {"$match": {"group_id": group_id, "status": "accepted"}},
+                {"$lookup": {
+                    "from": "daily_activity",
+                    "let": {"uid": "$user_id"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$and": [
+                            {"$eq": ["$user_id", "$$uid"]},
+                            {"$eq": ["$date", day]}
+                        ]}}},
+                        {"$project": {"has_target_today": 1, "marked_absent": 1}}
+                    ],
+                    "as": "activity"
+                }},
+                # Targets created today also count, even without an activity record
+                {"$lookup": {
+                    "from": "targets",
+                    "let": {"uid": "$user_id"},
+                    "pipeline": [
+                        {"$match": {
+                            "status": {"$in": VISIBLE_TARGET_STATUSES},
+                            "$expr": {"$and": [
+                                {"$eq": ["$user_id", "$$uid"]},
+                                {"$gte": ["$created_at", day]},
+                                {"$lt": ["$created_at", day + timedelta(days=1)]}
+                            ]}
+                        }},
+                        {"$limit": 1},
+                        {"$project": {"_id": 1}}
+                    ],
+                    "as": "today_targets"
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "user_id": 1,
+                    "username": {"$ifNull": ["$username", "Unknown"]},
+                    "has_target": {"$or": [
+                        {"$gt": [{"$size": "$today_targets"}, 0]},
+                        {"$anyElementTrue": ["$activity.has_target_today"]}
+                    ]},
+                    "marked_absent": {"$anyElementTrue": ["$activity.marked_absent"]}
+                }}
+            ]
+            return await self.registrations.aggregate(pipeline).to_list(length=None)
         except Exception as e:
-            print(f"Error recording notification: {e}")
+            print(f"Error getting daily attendance: {e}")
+            return []
     
-    def mark_user_absent(self, user_id: int, date: datetime.date, reason: str = "No target submitted"):
-        """Mark user as absent for the day"""
+    async def record_notification_sent(self, user_id: int, date: datetime.date, notification_type: str, now: datetime = None):
+        """Queue a record that a notification was sent to a user"""
+        now = now or datetime.now()
+        self._notification_queue.append(UpdateOne(
+            {"user_id": user_id, "date": _day_start(date)},
+            {
+                "$push": {"notifications_sent": {
+                    "type": notification_type,
+                    "sent_at": now
+                }},
+                "$set": {"last_notification": now}
+            },
+            upsert=True
+        ))
+        if len(self._notification_queue) >= NOTIFICATION_FLUSH_SIZE:
+            await self.flush_notifications()
+    
+    async def flush_notifications(self):
+        """Write all queued notification records in one batch"""
+        ops, self._notification_queue = self._notification_queue, []
+        if not ops:
+            return
         try:
-            self.daily_activity.update_one(
-                {"user_id": user_id, "date": date},
-                {
-                    "$set": {
+            # Reminder bookkeeping is telemetry, so skip the majority/journal wait
+            collection = self.daily_activity.with_options(write_concern=WriteConcern(w=1, j=False))
+            await collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            print(f"Error recording notifications: {e}")
+    
+    async def mark_users_absent(self, user_ids: List[int], date: datetime.date, reason: str = "No target submitted") -> bool:
+        """Mark several users as absent for the day in a single batch"""
+        if not user_ids:
+            return True
+        try:
+            day = _day_start(date)
+            marked_at = datetime.now()
+            await self.daily_activity.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "date": day},
+                    {"$set": {
                         "marked_absent": True,
                         "absent_reason": reason,
-                        "absent_marked_at": datetime.now()
-                    }
-                },
-                upsert=True
-            )
+                        "absent_marked_at": marked_at
+                    }},
+                    upsert=True
+                )
+                for user_id in user_ids
+            ], ordered=False)
             return True
         except Exception as e:
-            print(f"Error marking user absent: {e}")
+            print(f"Error marking users absent: {e}")
             return False
     
-    def get_user_daily_status(self, user_id: int, date: datetime.date) -> Dict:
+    async def get_user_daily_status(self, user_id: int, date: datetime.date) -> Dict:
         """Get user's daily status"""
         try:
-            activity = self.daily_activity.find_one({"user_id": user_id, "date": date})
+            activity = await self.daily_activity.find_one({"user_id": user_id, "date": _day_start(date)})
             if activity:
                 return {
                     "has_target": activity.get("has_target_today", False),
@@ -480,17 +1046,23 @@ class MongoDB:
                 "absent_reason": ""
             }
     
-    def export_all_data(self) -> List[Dict]:
-        """Export all data for backup"""
+    async def export_all_data(self) -> AsyncIterator[Dict]:
+        """Stream all data for backup, one document at a time"""
+        # Large batches keep round-trips down without holding the whole collection;
+        # a slow consumer may idle past the server's cursor timeout, so disable it
+        # and close the cursor explicitly instead
+        cursor = self.targets.find({}, no_cursor_timeout=True).batch_size(1000)
         try:
-            return list(self.targets.find({}))
-        except Exception as e:
-            print(f"Error exporting data: {e}")
-            return []
+            # Errors propagate so a cut-off export isn't reported as complete
+            async for document in cursor:
+                yield document
+        finally:
+            await cursor.close()
     
     def close(self):
         """Close database connection"""
         try:
+            _clients.pop(self.connection_string, None)
             self.client.close()
         except Exception as e:
             print(f"Error closing database connection: {e}")
@@ -1,17 +1,26 @@
-from http.server import BaseHTTPRequestHandler
-from http.server import HTTPServer
-import threading
+import asyncio
 
-def run_health_check():
-    class Handler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'Bot is running')
-    
-    server = HTTPServer(('0.0.0.0', 8080), Handler)
-    server.serve_forever()
+# Built once; every probe gets the same bytes whatever path it asks for
+HEALTH_RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 16\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b'{"status": "ok"}'
+)
 
-# Run in a separate thread
-threading.Thread(target=run_health_check, daemon=True).start()
+async def _handle_probe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer a health probe and close the connection"""
+    try:
+        await reader.read(1024)
+        writer.write(HEALTH_RESPONSE)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_health_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Serve health checks on the running event loop"""
+    return await asyncio.start_server(_handle_probe, host, port)
@@ -3,41 +3,172 @@ import logging
 import threading
 import time
 import asyncio
-import uuid
-from typing import Dict, List
+import re
+import functools
+import contextlib
+import io
+import csv
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta, date
 from dotenv import load_dotenv
+from bson import ObjectId
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
+from telegram.error import TelegramError
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, 
-    CallbackQueryHandler, filters, ContextTypes
+    CallbackQueryHandler, filters, ContextTypes, AIORateLimiter
 )
 from database import MongoDB
-from flask import Flask, jsonify
+from health_check import start_health_server
+from cachetools import TTLCache
 
 # Load environment variables
 load_dotenv()
 
 # Configuration
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-ALLOWED_GROUP_ID = os.getenv('ALLOWED_GROUP_ID')
-ADMIN_USER_ID = os.getenv('ADMIN_USER_ID')
+# Parsed once here so per-update checks are plain int comparisons
+ALLOWED_GROUP_ID = int(os.getenv('ALLOWED_GROUP_ID'))
+ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID'))
 MONGODB_URI = os.getenv('MONGODB_URI')
 PORT = int(os.getenv('PORT', 10000))
+# Set WEBHOOK_URL to have Telegram push updates instead of long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# The webhook takes over PORT, so health probes move to their own port
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', 8080)) if WEBHOOK_URL else PORT
+# Every handler is driven by messages or button presses
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
 # Notification times (24-hour format)
 NOTIFICATION_TIMES = [9, 12, 15, 17]  # 9 AM, 12 PM, 3 PM, 5 PM
+NOTIFICATION_TYPES = {
+    9: "first",
+    12: "second",
+    15: "third",
+    17: "final"
+}
 
-# Create Flask app for health checks
-app = Flask(__name__)
+# Callback routing patterns, compiled once rather than per registration
+ACCEPT_RULES_PATTERN = re.compile(r"^accept_rules_(?P<registration_id>[^_]*)$")
+DEADLINE_PATTERN = re.compile(r"^dl_(?P<target_id>[0-9a-f]{24})_(?P<days>\d+)$")
+# Target IDs (or their prefixes) as typed by users: up to 24 lowercase hex digits
+TARGET_ID_PREFIX_PATTERN = re.compile("[0-9a-f]{1,24}")
+# Deadline picker rows as (label, days); buttons carry "dl_<target_id>_<days>" as callback data
+DEADLINE_LAYOUT = (
+    (("1 day", 1), ("3 days", 3), ("7 days", 7)),
+    (("No deadline", 0),),
+)
 
-@app.route('/')
-def health_check():
-    return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
+# Target fields written to /export, in column order
+EXPORT_FIELDS = ("_id", "user_id", "username", "target", "status", "progress",
+                 "deadline", "created_at", "completed_at")
 
-@app.route('/health')
-def health():
-    return jsonify({"status": "ok"})
+# Static reply text, built once at import instead of on every command
+PRIVATE_WELCOME_SUFFIX = (
+    "!\n\n"
+    "I'm the Study Bot. I help manage study targets and group registrations.\n\n"
+    "**Daily Target System:**\n"
+    "• 9 AM: First reminder\n"
+    "• 12 PM: Second reminder\n"
+    "• 3 PM: Third reminder\n"
+    "• 5 PM: Final reminder & absent marking\n\n"
+    "**Important:** Upload your daily target before 5 PM to avoid being marked absent.\n\n"
+    "If you were asked to register for a group, please use the registration link provided in the group.\n\n"
+    "Commands available in group:\n"
+    "/settarget - Set a new study target\n"
+    "/mytargets - View your current targets\n"
+    "/progress - Update target progress\n"
+    "/completed - Mark target as completed\n"
+    "/stats - View your study statistics\n"
+    "/dailystatus - Check your daily attendance status\n"
+    "/help - Show help message"
+)
+GROUP_WELCOME_SUFFIX = (
+    " to Study Target Bot!\n\n"
+    "**📢 IMPORTANT DAILY REMINDERS:**\n"
+    "• 9 AM: First reminder\n"
+    "• 12 PM: Second reminder\n"
+    "• 3 PM: Third reminder\n"
+    "• 5 PM: Final reminder & absent marking\n\n"
+    "**⚠️ You must upload your daily study target before 5 PM to avoid being marked absent.**\n\n"
+    "📚 Available Commands:\n"
+    "/settarget - Set a new study target\n"
+    "/mytargets - View your current targets\n"
+    "/progress - Update target progress\n"
+    "/completed - Mark target as completed\n"
+    "/stats - View your study statistics\n"
+    "/dailystatus - Check your daily status\n"
+    "/help - Show help message\n"
+)
+RULES_MESSAGE = (
+    "📋 **Group Rules Declaration**\n\n"
+    "Please read and accept the following rules:\n\n"
+    "1. **Respect All Members**: Be polite and respectful to everyone.\n"
+    "2. **No Spam**: Do not post irrelevant content or advertisements.\n"
+    "3. **Study Focus**: Keep discussions related to learning and studies.\n"
+    "4. **No Harassment**: Any form of harassment will result in immediate ban.\n"
+    "5. **Follow Guidelines**: Adhere to group-specific guidelines.\n"
+    "6. **Help Others**: Share knowledge and help fellow students.\n"
+    "7. **Report Issues**: Report any problems to admins.\n"
+    "8. **Daily Targets**: Upload your study target every day before 5 PM.\n\n"
+    "By accepting, you agree to follow these rules."
+)
+# Filled with the newcomer's display name via str.format
+REGISTRATION_PROMPT_TEMPLATE = (
+    "👋 @{username}, welcome to our study group!\n\n"
+    "📋 **Group Rules:**\n"
+    "1. Be respectful to all members\n"
+    "2. No spam or self-promotion\n"
+    "3. Stay on topic - this is a study group\n"
+    "4. Use appropriate language\n"
+    "5. Follow Telegram's Terms of Service\n\n"
+    "⚠️ **You need to complete registration to participate**\n"
+    "Click the button below to start registration."
+)
+REGISTRATION_SUCCESS_TEXT = (
+    "✅ **Registration Successful!**\n\n"
+    "You have been unmuted in the group.\n"
+    "You can now participate in discussions.\n\n"
+    "**📢 IMPORTANT:**\n"
+    "• You must upload a daily study target before 5 PM\n"
+    "• Reminders will be sent at 9 AM, 12 PM, 3 PM, and 5 PM\n"
+    "• Missing targets will result in being marked absent\n\n"
+    "Welcome to our study community! 🎓"
+)
+REGISTERED_WELCOME_TEMPLATE = (
+    "🎉 Welcome @{username} to our study group!\n"
+    "Your registration is complete. Happy studying! 📚\n\n"
+    "**Reminder:** Don't forget to upload your daily study target!"
+)
+HELP_TEXT = (
+    "📚 Study Bot Help\n\n"
+    "**Daily Target System:**\n"
+    "• 9 AM: First reminder\n"
+    "• 12 PM: Second reminder\n"
+    "• 3 PM: Third reminder\n"
+    "• 5 PM: Final reminder & absent marking\n\n"
+    "**Commands:**\n"
+    "/start - Start the bot\n"
+    "/settarget <description> - Set a new study target\n"
+    "/mytargets [page] - View your current targets\n"
+    "/progress <id> <percentage> - Update target progress\n"
+    "/completed <id> - Mark target as completed\n"
+    "/stats - View your study statistics\n"
+    "/dailystatus - Check your daily attendance status\n"
+    "/attendance - Admin: View daily attendance report\n"
+    "/export - Admin: Export all data (admin only)\n"
+    "/checkmembers - Admin: Check and register existing members\n"
+    "/registeruser - Admin: Manually register a user\n"
+    "/help - Show this help message\n\n"
+    "**Tips:**\n"
+    "• Set realistic targets\n"
+    "• Update progress regularly\n"
+    "• Upload daily target before 5 PM\n"
+    "• Use partial target IDs (first 8 characters) for commands"
+)
+# Progress bar for every percentage, so rendering is a list lookup
+PROGRESS_BARS = ["█" * (p // 20) + "░" * (5 - p // 20) for p in range(101)]
 
 # Initialize MongoDB
 db = MongoDB(MONGODB_URI)
@@ -57,13 +188,115 @@ bot_status = {
     "processed_messages": 0
 }
 
+# Rendered /mytargets pages and /stats statistics per user; target writes invalidate them
+TARGETS_PAGE_SIZE = 20
+rendered_targets = TTLCache(maxsize=10_000, ttl=30)
+rendered_stats = TTLCache(maxsize=10_000, ttl=60)
+
+def invalidate_rendered(user_id: int):
+    """Forget cached command replies after a user's targets change"""
+    rendered_targets.pop(user_id, None)
+    rendered_stats.pop(user_id, None)
+
+def deadline_markup(target_id: str) -> InlineKeyboardMarkup:
+    """Fill the deadline picker layout with a target's id"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=f"dl_{target_id}_{days}") for label, days in row]
+        for row in DEADLINE_LAYOUT
+    ])
+
+def match_target(targets: List[Dict], id_prefix: str) -> Optional[ObjectId]:
+    """Find the ObjectId of the first target whose id starts with id_prefix"""
+    return next((target['_id'] for target in targets if str(target['_id']).startswith(id_prefix)), None)
+
+def display_name(user) -> str:
+    """Name to show for a Telegram user: username if set, else first name"""
+    return user.username or user.first_name
+
 # Check if user is in allowed group
-def is_allowed_group(chat_id: str) -> bool:
-    return str(chat_id) == ALLOWED_GROUP_ID
+def is_allowed_group(chat_id: int) -> bool:
+    return chat_id == ALLOWED_GROUP_ID
 
 # Check if user is admin
-def is_admin(user_id: str) -> bool:
-    return str(user_id) == ADMIN_USER_ID
+def is_admin(user_id: int) -> bool:
+    return user_id == ADMIN_USER_ID
+
+async def ensure_registration(user_id: int, chat_id: int, username: str) -> str:
+    """Return the user's registration id, creating a pending registration if needed"""
+    registration = await db.get_registration_status(user_id, chat_id)
+    if registration:
+        logger.info(f"Found existing registration for user {username}")
+        return str(registration.get('_id', ''))
+    
+    registration_id = await db.add_registration(user_id, chat_id, username)
+    logger.info(f"Created registration record for user {username}: {registration_id}")
+    return registration_id
+
+# Decorator for commands that require a completed registration
+def requires_registration(command_func):
+    """Run the command only for registered users; prompt everyone else to register"""
+    @functools.wraps(command_func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+        
+        registered = await db.is_user_registered(user_id, chat_id)
+        if registered is None:
+            # Don't mute a possibly registered user over a database hiccup
+            await update.message.reply_text("⚠️ Couldn't check your registration right now. Please try again shortly.")
+            return
+        if not registered:
+            _, registration_id = await asyncio.gather(
+                mute_user(chat_id, user_id, context, "Tried to use commands without registration"),
+                ensure_registration(user_id, chat_id, display_name(update.effective_user))
+            )
+            
+            keyboard = [[
+                InlineKeyboardButton(
+                    "📝 Register Now", 
+                    url=f"https://t.me/{context.bot.username}?start=register_{registration_id}"
+                )
+            ]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await update.message.reply_text(
+                f"⚠️ @{display_name(update.effective_user)}, "
+                "you need to register before using bot commands.\n\n"
+                "Click the button below to register:",
+                reply_markup=reply_markup
+            )
+            return
+        
+        await command_func(update, context)
+    
+    return wrapper
+
+def build_permissions(allowed: bool) -> ChatPermissions:
+    """Build ChatPermissions, dropping can_send_media_messages where it's unsupported"""
+    fields = {
+        "can_send_messages": allowed,
+        "can_send_media_messages": allowed,
+        "can_send_polls": allowed,
+        "can_send_other_messages": allowed,
+        "can_add_web_page_previews": allowed,
+        "can_change_info": False,
+        "can_invite_users": allowed,
+        "can_pin_messages": False
+    }
+    try:
+        return ChatPermissions(**fields)
+    except TypeError as e:
+        if "can_send_media_messages" not in str(e):
+            raise
+        # Fallback to older version format
+        logger.info("Using older ChatPermissions format (no can_send_media_messages)")
+        del fields["can_send_media_messages"]
+        return ChatPermissions(**fields)
+
+# Mute and unmute apply the same permission sets to everyone, so build them once
+MUTED_PERMISSIONS = build_permissions(False)
+UNMUTED_PERMISSIONS = build_permissions(True)
+MUTE_DURATION = timedelta(days=7)
 
 # COMPATIBLE MUTE FUNCTION - Works with older python-telegram-bot versions
 async def mute_user(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, reason: str = "Not registered") -> bool:
@@ -72,41 +305,12 @@ async def mute_user(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TY
         # Log the attempt
         logger.info(f"Attempting to mute user {user_id} in chat {chat_id} for: {reason}")
         
-        # Try different permission formats for compatibility
-        try:
-            # Try new version format (python-telegram-bot >= 13.0)
-            permissions = ChatPermissions(
-                can_send_messages=False,
-                can_send_media_messages=False,
-                can_send_polls=False,
-                can_send_other_messages=False,
-                can_add_web_page_previews=False,
-                can_change_info=False,
-                can_invite_users=False,
-                can_pin_messages=False
-            )
-        except TypeError as e:
-            if "can_send_media_messages" in str(e):
-                # Fallback to older version format
-                logger.info("Using older ChatPermissions format (no can_send_media_messages)")
-                permissions = ChatPermissions(
-                    can_send_messages=False,
-                    can_send_polls=False,
-                    can_send_other_messages=False,
-                    can_add_web_page_previews=False,
-                    can_change_info=False,
-                    can_invite_users=False,
-                    can_pin_messages=False
-                )
-            else:
-                raise e
-        
         # Try to restrict the user
         await context.bot.restrict_chat_member(
             chat_id=chat_id,
             user_id=user_id,
-            permissions=permissions,
-            until_date=datetime.now() + timedelta(days=7)  # 7 days mute
+            permissions=MUTED_PERMISSIONS,
+            until_date=datetime.now() + MUTE_DURATION
         )
         
         logger.info(f"✅ Successfully muted user {user_id} in group {chat_id}")
@@ -128,40 +332,11 @@ async def mute_user(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TY
 async def unmute_user(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Unmute a user in the group - COMPATIBLE VERSION"""
     try:
-        # Try different permission formats for compatibility
-        try:
-            # Try new version format
-            permissions = ChatPermissions(
-                can_send_messages=True,
-                can_send_media_messages=True,
-                can_send_polls=True,
-                can_send_other_messages=True,
-                can_add_web_page_previews=True,
-                can_change_info=False,
-                can_invite_users=True,
-                can_pin_messages=False
-            )
-        except TypeError as e:
-            if "can_send_media_messages" in str(e):
-                # Fallback to older version format
-                logger.info("Using older ChatPermissions format for unmute")
-                permissions = ChatPermissions(
-                    can_send_messages=True,
-                    can_send_polls=True,
-                    can_send_other_messages=True,
-                    can_add_web_page_previews=True,
-                    can_change_info=False,
-                    can_invite_users=True,
-                    can_pin_messages=False
-                )
-            else:
-                raise e
-        
         # Restore permissions
         await context.bot.restrict_chat_member(
             chat_id=chat_id,
             user_id=user_id,
-            permissions=permissions
+            permissions=UNMUTED_PERMISSIONS
         )
         
         logger.info(f"✅ Successfully unmuted user {user_id} in group {chat_id}")
@@ -191,7 +366,7 @@ async def send_registration_prompt(chat_id: int, user_id: int, username: str, co
         
         # If no registration_id provided, create one
         if not registration_id:
-            registration_id = db.add_registration(user_id, chat_id, username)
+            registration_id = await db.add_registration(user_id, chat_id, username)
             if not registration_id:
                 logger.error(f"Failed to create registration for user {user_id}")
                 return False
@@ -206,24 +381,12 @@ async def send_registration_prompt(chat_id: int, user_id: int, username: str, co
         ]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # Create welcome message
-        welcome_message = (
-            f"👋 @{username}, welcome to our study group!\n\n"
-            "📋 **Group Rules:**\n"
-            "1. Be respectful to all members\n"
-            "2. No spam or self-promotion\n"
-            "3. Stay on topic - this is a study group\n"
-            "4. Use appropriate language\n"
-            "5. Follow Telegram's Terms of Service\n\n"
-            "⚠️ **You need to complete registration to participate**\n"
-            "Click the button below to start registration."
-        )
         
         # Try to send message in group
         try:
             await context.bot.send_message(
                 chat_id=chat_id,
-                text=welcome_message,
+                text=REGISTRATION_PROMPT_TEMPLATE.format(username=username),
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
@@ -251,73 +414,81 @@ async def send_registration_prompt(chat_id: int, user_id: int, username: str, co
         logger.error(f"Failed to send registration prompt to {user_id}: {e}")
         return False
 
+async def onboard_new_member(chat_id: int, member: Dict, context: ContextTypes.DEFAULT_TYPE):
+    """Mute an unregistered newcomer and send their registration prompt"""
+    user_id, username = member["user_id"], member["username"]
+    logger.info(f"Processing new member: {username} (ID: {user_id})")
+    
+    registration_id = member["registration_id"]
+    if registration_id:
+        # The prompt goes out whether or not the mute succeeds, so send both at once
+        mute_success, prompt_sent = await asyncio.gather(
+            mute_user(chat_id, user_id, context, "New member registration required"),
+            send_registration_prompt(chat_id, user_id, username, context, registration_id)
+        )
+    else:
+        mute_success, registration_id = await asyncio.gather(
+            mute_user(chat_id, user_id, context, "New member registration required"),
+            ensure_registration(user_id, chat_id, username)
+        )
+        prompt_sent = await send_registration_prompt(chat_id, user_id, username, context, registration_id)
+    
+    if mute_success:
+        logger.info(f"✅ New member {username} muted successfully")
+    else:
+        logger.error(f"❌ Failed to mute new member {username}")
+    
+    if prompt_sent:
+        logger.info(f"✅ Registration prompt sent to {username}")
+    else:
+        logger.error(f"❌ Failed to send registration prompt to {username}")
+
 # Handler for new members joining the group
 async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle new members joining the group"""
     try:
-        if not is_allowed_group(update.effective_chat.id):
-            return
-        
         if update.effective_chat.type not in ['group', 'supergroup']:
             return
         
-        logger.info(f"New member(s) joined group {update.effective_chat.id}")
+        chat_id = update.effective_chat.id
+        logger.info(f"New member(s) joined group {chat_id}")
         
-        for member in update.message.new_chat_members:
-            user_id = member.id
-            username = member.username or member.first_name
-            
-            # Skip if it's the bot itself
-            if member.id == context.bot.id:
-                logger.info("Bot itself joined, skipping")
-                continue
-            
-            logger.info(f"Processing new member: {username} (ID: {user_id})")
-            
-            # Track member in database
-            db.add_group_member(user_id, update.effective_chat.id, username)
-            
-            # Check if user is already registered
-            if db.is_user_registered(user_id, update.effective_chat.id):
-                await update.message.reply_text(
-                    f"Welcome back, @{username}! You're already registered."
-                )
-                logger.info(f"User {username} is already registered")
-                continue
-            
-            # Mute the new member
-            mute_success = await mute_user(
-                update.effective_chat.id, 
-                user_id, 
-                context, 
-                "New member registration required"
+        # Skip the bot itself
+        usernames = {
+            member.id: display_name(member)
+            for member in update.message.new_chat_members
+            if member.id != context.bot.id
+        }
+        if not usernames:
+            logger.info("Bot itself joined, skipping")
+            return
+        
+        # One tracking write and one registration batch for the whole join burst
+        unregistered = await db.add_new_members(chat_id, usernames)
+        if unregistered is None:
+            # Batch failed: fall back to per-user checks; newcomers whose check
+            # also fails are treated as unregistered and muted until they register
+            registered = await asyncio.gather(*(
+                db.is_user_registered(user_id, chat_id) for user_id in usernames
+            ))
+            unregistered = [
+                {"user_id": user_id, "username": username, "registration_id": None}
+                for (user_id, username), is_registered in zip(usernames.items(), registered)
+                if not is_registered
+            ]
+        
+        pending = {member["user_id"] for member in unregistered}
+        returning = [f"@{name}" for user_id, name in usernames.items() if user_id not in pending]
+        if returning:
+            await update.message.reply_text(
+                f"Welcome back, {', '.join(returning)}! You're already registered."
             )
-            
-            if mute_success:
-                logger.info(f"✅ New member {username} muted successfully")
-                
-                # Send registration prompt
-                prompt_sent = await send_registration_prompt(
-                    update.effective_chat.id, 
-                    user_id, 
-                    username, 
-                    context
-                )
-                
-                if prompt_sent:
-                    logger.info(f"✅ Registration prompt sent to {username}")
-                else:
-                    logger.error(f"❌ Failed to send registration prompt to {username}")
-                    
-            else:
-                logger.error(f"❌ Failed to mute new member {username}")
-                # Still try to send registration prompt even if mute failed
-                await send_registration_prompt(
-                    update.effective_chat.id, 
-                    user_id, 
-                    username, 
-                    context
-                )
+            logger.info(f"Already registered: {', '.join(returning)}")
+        
+        # Each newcomer needs their own registration link, so mute and prompt them side by side
+        await asyncio.gather(*(
+            onboard_new_member(chat_id, member, context) for member in unregistered
+        ))
                 
     except Exception as e:
         logger.error(f"Error in new_member_handler: {e}")
@@ -334,19 +505,15 @@ async def check_and_mute_unregistered(update: Update, context: ContextTypes.DEFA
         if update.message.text.startswith('/'):
             return
         
-        # Check group
-        if not is_allowed_group(update.effective_chat.id):
-            return
-        
         if update.effective_chat.type not in ['group', 'supergroup']:
             return
         
         user_id = update.effective_user.id
         chat_id = update.effective_chat.id
-        username = update.effective_user.username or update.effective_user.first_name
+        username = display_name(update.effective_user)
         
         # Skip admin and bot itself
-        if is_admin(str(user_id)):
+        if is_admin(user_id):
             logger.info(f"Admin {username} sent message, skipping")
             return
         
@@ -356,24 +523,23 @@ async def check_and_mute_unregistered(update: Update, context: ContextTypes.DEFA
         logger.info(f"Checking message from user {username} (ID: {user_id})")
         
         # Check if user is registered
-        if not db.is_user_registered(user_id, chat_id):
+        registered = await db.is_user_registered(user_id, chat_id)
+        if registered is None:
+            # Fail open: a failed lookup must not mute a registered member
+            logger.warning(f"Couldn't check registration for {username}, not muting")
+            return
+        if not registered:
             logger.warning(f"User {username} is not registered!")
             
-            # Try to mute the user
-            mute_success = await mute_user(chat_id, user_id, context, "Unregistered user sent message")
+            # The mute and the registration lookup are independent, so overlap them
+            mute_success, registration_id = await asyncio.gather(
+                mute_user(chat_id, user_id, context, "Unregistered user sent message"),
+                ensure_registration(user_id, chat_id, username)
+            )
             
             if mute_success:
                 logger.info(f"✅ Muted unregistered user {username}")
             
-            # Get or create registration
-            registration = db.get_registration_status(user_id, chat_id)
-            if not registration:
-                registration_id = db.add_registration(user_id, chat_id, username)
-                logger.info(f"Created registration record for user {username}: {registration_id}")
-            else:
-                registration_id = str(registration.get('_id', ''))
-                logger.info(f"Found existing registration for user {username}")
-            
             # Send registration prompt
             await send_registration_prompt(
                 chat_id,
@@ -399,16 +565,13 @@ async def check_and_mute_unregistered(update: Update, context: ContextTypes.DEFA
 # Command to check and register existing members
 async def check_existing_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check existing members and register those who aren't"""
-    if not is_allowed_group(update.effective_chat.id):
-        return
-    
     if not is_admin(update.effective_user.id):
         await update.message.reply_text("This command is for admins only.")
         return
     
     await update.message.reply_text("🔍 Checking existing members...")
     
-    unregistered_members = db.check_and_register_existing_members(
+    unregistered_members = await db.check_and_register_existing_members(
         update.effective_chat.id, 
         context
     )
@@ -420,30 +583,26 @@ async def check_existing_members(update: Update, context: ContextTypes.DEFAULT_T
     processed = 0
     for member in unregistered_members:
         try:
-            chat_member = await context.bot.get_chat_member(
-                update.effective_chat.id,
-                member["user_id"]
-            )
-            
-            username = chat_member.user.username or chat_member.user.first_name
-            
-            await mute_user(
-                update.effective_chat.id, 
-                member["user_id"], 
-                context, 
-                "Existing member registration required"
-            )
-            
-            await send_registration_prompt(
-                update.effective_chat.id,
-                member["user_id"],
-                username,
-                context,
-                member["registration_id"]
+            # The mute and the prompt are independent Bot API calls
+            await asyncio.gather(
+                mute_user(
+                    update.effective_chat.id, 
+                    member["user_id"], 
+                    context, 
+                    "Existing member registration required"
+                ),
+                send_registration_prompt(
+                    update.effective_chat.id,
+                    member["user_id"],
+                    member["username"],
+                    context,
+                    member["registration_id"]
+                )
             )
             
             processed += 1
-            time.sleep(0.5)
+            # Yield to the event loop while pacing, instead of blocking it
+            await asyncio.sleep(0.5)
             
         except Exception as e:
             logger.error(f"Error processing member {member['user_id']}: {e}")
@@ -458,23 +617,21 @@ async def check_existing_members(update: Update, context: ContextTypes.DEFAULT_T
 async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
     """Send daily reminders to users who haven't uploaded targets"""
     try:
-        today = date.today()
-        current_hour = datetime.now().hour
-        
-        notification_types = {
-            9: "first",
-            12: "second", 
-            15: "third",
-            17: "final"
-        }
+        now = datetime.now()
+        today = now.date()
+        current_hour = now.hour
         
-        notification_type = notification_types.get(current_hour)
+        # Scheduled runs carry their reminder type; manual runs fall back to the clock
+        if context.job and context.job.data:
+            notification_type = context.job.data
+        else:
+            notification_type = NOTIFICATION_TYPES.get(current_hour)
         if not notification_type:
             return
         
         logger.info(f"Sending {notification_type} daily reminder at {current_hour}:00")
         
-        users_without_target = db.get_users_without_target_today(today)
+        users_without_target = await db.get_users_without_target_today(today, ALLOWED_GROUP_ID)
         
         if not users_without_target:
             logger.info("All users have uploaded targets today.")
@@ -541,7 +698,7 @@ async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
                     parse_mode='Markdown'
                 )
                 
-                db.record_notification_sent(user["user_id"], today, notification_type)
+                await db.record_notification_sent(user["user_id"], today, notification_type, now=now)
                 
                 sent_count += 1
                 logger.info(f"Sent {notification_type} reminder to user {user['user_id']}")
@@ -553,9 +710,12 @@ async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Failed to send reminder to user {user['user_id']}: {e}")
                 continue
         
+        # Write the queued reminder records in one batch
+        await db.flush_notifications()
         logger.info(f"Sent {sent_count} reminders, failed: {failed_count}")
         
         if notification_type == "final":
+            # Query again: users may have set a target in reply to the final reminder
             await mark_absent_users(context, today)
             
     except Exception as e:
@@ -567,21 +727,22 @@ async def mark_absent_users(context: ContextTypes.DEFAULT_TYPE, today: date):
     try:
         logger.info("Marking absent users for today...")
         
-        users_without_target = db.get_users_without_target_today(today)
+        users_without_target = await db.get_users_without_target_today(today, ALLOWED_GROUP_ID)
         
         if not users_without_target:
             logger.info("No users to mark as absent.")
             return
         
-        absent_count = 0
+        user_ids = [user["user_id"] for user in users_without_target]
+        if not await db.mark_users_absent(user_ids, today, "No daily target submitted"):
+            logger.error("Failed to mark absent users in database")
+            return
+        
+        absent_count = len(user_ids)
+        # Absences are drawn from accepted registrations, so everyone else there was present
+        registered_count = await db.count_registered_users(ALLOWED_GROUP_ID)
         for user in users_without_target:
             try:
-                db.mark_user_absent(
-                    user["user_id"], 
-                    today, 
-                    "No daily target submitted"
-                )
-                
                 absent_message = (
                     "📋 **Daily Attendance Report**\n\n"
                     "❌ You have been marked as **ABSENT** for today.\n\n"
@@ -598,27 +759,27 @@ async def mark_absent_users(context: ContextTypes.DEFAULT_TYPE, today: date):
                     parse_mode='Markdown'
                 )
                 
-                absent_count += 1
                 logger.info(f"Marked user {user['user_id']} as absent")
                 
                 await asyncio.sleep(0.1)
                 
             except Exception as e:
-                logger.error(f"Failed to mark user {user['user_id']} as absent: {e}")
+                logger.error(f"Failed to notify absent user {user['user_id']}: {e}")
                 continue
         
         # Send summary to admin
         try:
+            present = max(registered_count - absent_count, 0) if registered_count is not None else "unknown"
             admin_message = (
                 f"📊 **Daily Attendance Summary**\n\n"
                 f"**Date:** {today.strftime('%Y-%m-%d')}\n"
                 f"**Total Absent:** {absent_count}\n"
-                f"**Total Present:** {len(users_without_target) - absent_count}\n\n"
+                f"**Total Present:** {present}\n\n"
                 f"Absent marking completed successfully. ✅"
             )
             
             await context.bot.send_message(
-                chat_id=int(ADMIN_USER_ID),
+                chat_id=ADMIN_USER_ID,
                 text=admin_message,
                 parse_mode='Markdown'
             )
@@ -631,21 +792,16 @@ async def mark_absent_users(context: ContextTypes.DEFAULT_TYPE, today: date):
         logger.error(f"Error marking absent users: {e}")
 
 # Command to check daily status
+@requires_registration
 async def daily_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check user's daily status"""
-    if not is_allowed_group(update.effective_chat.id):
-        return
-    
     user_id = update.effective_user.id
-    today = date.today()
+    now = datetime.now()
+    today = now.date()
     
-    status = db.get_user_daily_status(user_id, today)
+    status = await db.get_user_daily_status(user_id, today)
     
-    user_targets = db.get_user_targets(user_id)
-    today_targets = [
-        target for target in user_targets 
-        if target.get("created_at") and target["created_at"].date() == today
-    ]
+    today_targets = await db.get_user_targets_for_day(user_id, today)
     
     message = f"📊 **Daily Status for {today.strftime('%Y-%m-%d')}**\n\n"
     
@@ -668,7 +824,7 @@ async def daily_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if notifications:
             message += "**Reminders received:**\n"
             for note in notifications[-3:]:
-                note_time = note.get("sent_at", datetime.now())
+                note_time = note.get("sent_at", now)
                 if isinstance(note_time, str):
                     note_time = datetime.fromisoformat(note_time)
                 message += f"• {note_time.strftime('%I:%M %p')} - {note['type'].title()} reminder\n"
@@ -676,7 +832,7 @@ async def daily_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if status["marked_absent"]:
             message += f"\n⚠️ **Absent Marked:** {status['absent_reason']}\n"
         else:
-            current_hour = datetime.now().hour
+            current_hour = now.hour
             next_reminder = None
             
             for hour in NOTIFICATION_TIMES:
@@ -696,20 +852,16 @@ async def daily_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(message, parse_mode='Markdown')
 
 # Admin command to view daily attendance
+@requires_registration
 async def attendance_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin: View daily attendance report"""
-    if not is_allowed_group(update.effective_chat.id):
-        return
-    
     if not is_admin(update.effective_user.id):
         await update.message.reply_text("This command is for admins only.")
         return
     
     today = date.today()
     
-    registered_users = list(db.registrations.find(
-        {"group_id": int(ALLOWED_GROUP_ID), "status": "accepted"}
-    ))
+    registered_users = await db.get_daily_attendance(ALLOWED_GROUP_ID, today)
     
     if not registered_users:
         await update.message.reply_text("No registered users found.")
@@ -721,27 +873,16 @@ async def attendance_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     attendance_list = []
     
     for user in registered_users:
-        user_id = user["user_id"]
-        username = user.get("username", "Unknown")
-        
-        status = db.get_user_daily_status(user_id, today)
-        
-        user_targets = db.get_user_targets(user_id)
-        has_target_today = any(
-            target.get("created_at") and target["created_at"].date() == today
-            for target in user_targets
-        )
-        
-        if has_target_today or status["has_target"]:
+        if user["has_target"]:
             status_text = "✅ PRESENT"
             present_count += 1
-        elif status["marked_absent"]:
+        elif user["marked_absent"]:
             status_text = "❌ ABSENT"
             absent_count += 1
         else:
             status_text = "⏳ PENDING"
         
-        attendance_list.append(f"{status_text} - @{username}")
+        attendance_list.append(f"{status_text} - @{user['username']}")
     
     report = (
         f"📊 **Daily Attendance Report**\n\n"
@@ -771,19 +912,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args and context.args[0].startswith('register_'):
         registration_id = context.args[0].replace('register_', '')
         
-        rules_message = (
-            "📋 **Group Rules Declaration**\n\n"
-            "Please read and accept the following rules:\n\n"
-            "1. **Respect All Members**: Be polite and respectful to everyone.\n"
-            "2. **No Spam**: Do not post irrelevant content or advertisements.\n"
-            "3. **Study Focus**: Keep discussions related to learning and studies.\n"
-            "4. **No Harassment**: Any form of harassment will result in immediate ban.\n"
-            "5. **Follow Guidelines**: Adhere to group-specific guidelines.\n"
-            "6. **Help Others**: Share knowledge and help fellow students.\n"
-            "7. **Report Issues**: Report any problems to admins.\n"
-            "8. **Daily Targets**: Upload your study target every day before 5 PM.\n\n"
-            "By accepting, you agree to follow these rules."
-        )
         
         keyboard = [[
             InlineKeyboardButton("✅ I Accept All Rules", callback_data=f"accept_rules_{registration_id}")
@@ -791,51 +919,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await update.message.reply_text(
-            rules_message,
+            RULES_MESSAGE,
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
         return
     
     if update.effective_chat.type == 'private':
-        welcome_message = (
-            f"👋 Hello {user.first_name}!\n\n"
-            "I'm the Study Bot. I help manage study targets and group registrations.\n\n"
-            "**Daily Target System:**\n"
-            "• 9 AM: First reminder\n"
-            "• 12 PM: Second reminder\n"
-            "• 3 PM: Third reminder\n"
-            "• 5 PM: Final reminder & absent marking\n\n"
-            "**Important:** Upload your daily target before 5 PM to avoid being marked absent.\n\n"
-            "If you were asked to register for a group, please use the registration link provided in the group.\n\n"
-            "Commands available in group:\n"
-            "/settarget - Set a new study target\n"
-            "/mytargets - View your current targets\n"
-            "/progress - Update target progress\n"
-            "/completed - Mark target as completed\n"
-            "/stats - View your study statistics\n"
-            "/dailystatus - Check your daily attendance status\n"
-            "/help - Show help message"
-        )
+        welcome_message = f"👋 Hello {user.first_name}{PRIVATE_WELCOME_SUFFIX}"
         await update.message.reply_text(welcome_message)
     elif is_allowed_group(update.effective_chat.id):
-        welcome_message = (
-            f"🎯 Welcome {user.first_name} to Study Target Bot!\n\n"
-            "**📢 IMPORTANT DAILY REMINDERS:**\n"
-            "• 9 AM: First reminder\n"
-            "• 12 PM: Second reminder\n"
-            "• 3 PM: Third reminder\n"
-            "• 5 PM: Final reminder & absent marking\n\n"
-            "**⚠️ You must upload your daily study target before 5 PM to avoid being marked absent.**\n\n"
-            "📚 Available Commands:\n"
-            "/settarget - Set a new study target\n"
-            "/mytargets - View your current targets\n"
-            "/progress - Update target progress\n"
-            "/completed - Mark target as completed\n"
-            "/stats - View your study statistics\n"
-            "/dailystatus - Check your daily status\n"
-            "/help - Show help message\n"
-        )
+        welcome_message = f"🎯 Welcome {user.first_name}{GROUP_WELCOME_SUFFIX}"
         await update.message.reply_text(welcome_message)
 
 # Accept rules callback handler
@@ -844,87 +938,37 @@ async def accept_rules_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split('_')
-    if len(data) != 3:
-        await query.edit_message_text("Registration error. Please contact admin.")
-        return
-    
-    registration_id = data[2]
+    # PTB already matched ACCEPT_RULES_PATTERN to route here; reuse its groups
+    registration_id = context.matches[0]["registration_id"]
     user_id = query.from_user.id
+    logger.info(f"User {user_id} accepting rules for registration {registration_id}")
     
-    success = db.accept_rules(user_id, int(ALLOWED_GROUP_ID))
+    success = await db.accept_rules(user_id, ALLOWED_GROUP_ID)
     
     if success:
-        await unmute_user(int(ALLOWED_GROUP_ID), user_id, context)
-        
-        await query.edit_message_text(
-            "✅ **Registration Successful!**\n\n"
-            "You have been unmuted in the group.\n"
-            "You can now participate in discussions.\n\n"
-            "**📢 IMPORTANT:**\n"
-            "• You must upload a daily study target before 5 PM\n"
-            "• Reminders will be sent at 9 AM, 12 PM, 3 PM, and 5 PM\n"
-            "• Missing targets will result in being marked absent\n\n"
-            "Welcome to our study community! 🎓",
-            parse_mode='Markdown'
+        # Unmute, confirm privately and announce in the group in one round-trip of wall time
+        results = await asyncio.gather(
+            unmute_user(ALLOWED_GROUP_ID, user_id, context),
+            query.edit_message_text(
+                REGISTRATION_SUCCESS_TEXT,
+                parse_mode='Markdown'
+            ),
+            context.bot.send_message(
+                chat_id=ALLOWED_GROUP_ID,
+                text=REGISTERED_WELCOME_TEMPLATE.format(username=display_name(query.from_user))
+            ),
+            return_exceptions=True
         )
-        
-        try:
-            await context.bot.send_message(
-                chat_id=int(ALLOWED_GROUP_ID),
-                text=f"🎉 Welcome @{query.from_user.username or query.from_user.first_name} to our study group!\n"
-                     "Your registration is complete. Happy studying! 📚\n\n"
-                     "**Reminder:** Don't forget to upload your daily study target!"
-            )
-        except Exception as e:
-            logger.error(f"Failed to send group message: {e}")
+        for step, result in zip(("unmute", "confirmation", "group message"), results):
+            if isinstance(result, Exception):
+                logger.error(f"Registration {step} failed for user {user_id}: {result}")
     else:
         await query.edit_message_text(
             "❌ Registration failed. Please contact an admin for assistance."
         )
 
-# Modified wrapper to check registration for commands
-async def check_registration_and_execute(update: Update, context: ContextTypes.DEFAULT_TYPE, command_func):
-    """Check if user is registered before executing command"""
-    if not is_allowed_group(update.effective_chat.id):
-        return
-    
-    user_id = update.effective_user.id
-    chat_id = update.effective_chat.id
-    
-    if not db.is_user_registered(user_id, chat_id):
-        registration = db.get_registration_status(user_id, chat_id)
-        
-        if not registration:
-            username = update.effective_user.username or update.effective_user.first_name
-            registration_id = db.add_registration(user_id, chat_id, username)
-        else:
-            registration_id = str(registration.get('_id', ''))
-        
-        await mute_user(chat_id, user_id, context, "Tried to use commands without registration")
-        
-        keyboard = [[
-            InlineKeyboardButton(
-                "📝 Register Now", 
-                url=f"https://t.me/{context.bot.username}?start=register_{registration_id}"
-            )
-        ]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            f"⚠️ @{update.effective_user.username or update.effective_user.first_name}, "
-            "you need to register before using bot commands.\n\n"
-            "Click the button below to register:",
-            reply_markup=reply_markup
-        )
-        return
-    
-    await command_func(update, context)
-
-# Store temporary callback data for deadline buttons
-deadline_callbacks = {}
-
 # Set target command
+@requires_registration
 async def set_target(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Set a new study target"""
     if not context.args:
@@ -936,37 +980,28 @@ async def set_target(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     target_text = " ".join(context.args)
+    now = datetime.now()
     
     target_data = {
         "user_id": user_id,
-        "username": update.effective_user.username or update.effective_user.first_name,
+        "username": display_name(update.effective_user),
         "target": target_text,
         "status": "active",
         "progress": 0,
-        "created_at": datetime.now(),
+        "created_at": now,
         "deadline": None,
         "completed_at": None
     }
     
     try:
-        target_id = db.add_target(target_data)
+        target_id = await db.add_target(target_data, today=now.date())
+        invalidate_rendered(user_id)
         
         if not target_id:
             await update.message.reply_text("❌ Failed to save target. Please try again.")
             return
         
-        callback_id = str(uuid.uuid4())[:8]
-        deadline_callbacks[callback_id] = target_id
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("1 day", callback_data=f"deadline_{callback_id}_1"),
-                InlineKeyboardButton("3 days", callback_data=f"deadline_{callback_id}_3"),
-                InlineKeyboardButton("7 days", callback_data=f"deadline_{callback_id}_7"),
-            ],
-            [InlineKeyboardButton("No deadline", callback_data=f"deadline_{callback_id}_0")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = deadline_markup(target_id)
         
         await update.message.reply_text(
             f"✅ Target set successfully!\n\n"
@@ -988,25 +1023,16 @@ async def deadline_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split('_')
-    if len(data) != 3:
-        await query.edit_message_text("❌ Invalid callback data.")
-        return
-    
-    callback_id = data[1]
-    days = int(data[2])
-    
-    target_id = deadline_callbacks.get(callback_id)
-    
-    if not target_id:
-        await query.edit_message_text("❌ Target not found. Please set the target again.")
-        return
+    # PTB already matched DEADLINE_PATTERN to route here; reuse its groups
+    match = context.matches[0]
+    target_id, days = match["target_id"], int(match["days"])
     
     if days > 0:
         deadline = datetime.now() + timedelta(days=days)
-        success = db.update_target_deadline(target_id, deadline)
+        updated = await db.update_target_deadline(target_id, deadline)
         
-        if success:
+        if updated is not None:
+            invalidate_rendered(updated["user_id"])
             await query.edit_message_text(
                 text=f"⏰ Deadline set for {days} day(s) from now!"
             )
@@ -1018,37 +1044,55 @@ async def deadline_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(
             text="✅ Target saved without deadline."
         )
-    
-    if callback_id in deadline_callbacks:
-        del deadline_callbacks[callback_id]
 
+@requires_registration
 async def my_targets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    targets = db.get_user_targets(user_id)
+    page = int(context.args[0]) if context.args and context.args[0].isdigit() else 1
+    page = max(page, 1)
+    
+    pages = rendered_targets.setdefault(user_id, {})
+    message = pages.get(page)
+    if message is not None:
+        await update.message.reply_text(message)
+        return
+    
+    skip = (page - 1) * TARGETS_PAGE_SIZE
+    targets = await db.get_user_targets(user_id, skip=skip, limit=TARGETS_PAGE_SIZE)
     
     if not targets:
-        await update.message.reply_text("You don't have any active targets.")
+        if page > 1:
+            await update.message.reply_text(f"No targets on page {page}.")
+        else:
+            await update.message.reply_text("You don't have any active targets.")
         return
     
-    message = "📚 Your Current Targets:\n\n"
-    for i, target in enumerate(targets, 1):
+    parts = [f"📚 Your Current Targets (page {page}):\n\n"]
+    for i, target in enumerate(targets, skip + 1):
         status_icon = "✅" if target["status"] == "completed" else "⏳"
-        progress_bar = "█" * (target["progress"] // 20) + "░" * (5 - target["progress"] // 20)
+        progress_bar = PROGRESS_BARS[min(max(target["progress"], 0), 100)]
         
-        message += (
+        parts.append(
             f"{i}. {status_icon} {target['target']}\n"
             f"   📊 Progress: {progress_bar} {target['progress']}%\n"
             f"   🆔 ID: {str(target['_id'])[:8]}...\n"
         )
         
-        if target.get('deadline'):
-            deadline = target['deadline'].strftime("%Y-%m-%d")
-            message += f"   ⏰ Deadline: {deadline}\n"
-        
-        message += "\n"
+        deadline = target.get('deadline')
+        if deadline:
+            # isoformat on the date gives the same YYYY-MM-DD without strftime's format parsing
+            parts.append(f"   ⏰ Deadline: {deadline.date().isoformat()}\n\n")
+        else:
+            parts.append("\n")
+    
+    if len(targets) == TARGETS_PAGE_SIZE:
+        parts.append(f"➡️ More: /mytargets {page + 1}\n")
     
+    message = "".join(parts)
+    pages[page] = message
     await update.message.reply_text(message)
 
+@requires_registration
 async def update_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Update target progress"""
     if len(context.args) != 2:
@@ -1069,32 +1113,33 @@ async def update_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please enter a valid percentage (0-100).")
         return
     
-    user_id = update.effective_user.id
-    targets = db.get_user_targets(user_id)
+    if not TARGET_ID_PREFIX_PATTERN.fullmatch(target_id_partial):
+        await update.message.reply_text(f"❌ '{target_id_partial}' is not a valid target ID.")
+        return
     
-    target_id = None
-    for target in targets:
-        if str(target['_id']).startswith(target_id_partial):
-            target_id = str(target['_id'])
-            break
+    user_id = update.effective_user.id
+    targets = await db.get_user_targets(user_id)
+    target_id = match_target(targets, target_id_partial)
     
-    if not target_id:
+    if target_id is None:
         await update.message.reply_text(
             f"❌ Target with ID '{target_id_partial}' not found.\n"
             f"Use /mytargets to see your targets and their IDs."
         )
         return
     
-    success = db.update_target_progress(target_id, progress)
+    updated = await db.update_target_progress(target_id, progress)
+    invalidate_rendered(user_id)
     
-    if success:
+    if updated is not None:
         await update.message.reply_text(
             f"📊 Progress updated to {progress}%!\n"
-            f"Target ID: {target_id[:8]}..."
+            f"Target ID: {str(target_id)[:8]}..."
         )
     else:
         await update.message.reply_text("❌ Target not found or update failed.")
 
+@requires_registration
 async def mark_completed(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mark target as completed"""
     if not context.args:
@@ -1107,51 +1152,65 @@ async def mark_completed(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     target_id_partial = context.args[0]
     
-    user_id = update.effective_user.id
-    targets = db.get_user_targets(user_id)
+    if not TARGET_ID_PREFIX_PATTERN.fullmatch(target_id_partial):
+        await update.message.reply_text(f"❌ '{target_id_partial}' is not a valid target ID.")
+        return
     
-    target_id = None
-    for target in targets:
-        if str(target['_id']).startswith(target_id_partial):
-            target_id = str(target['_id'])
-            break
+    user_id = update.effective_user.id
+    targets = await db.get_user_targets(user_id)
+    target_id = match_target(targets, target_id_partial)
     
-    if not target_id:
+    if target_id is None:
         await update.message.reply_text(
             f"❌ Target with ID '{target_id_partial}' not found.\n"
             f"Use /mytargets to see your targets and their IDs."
         )
         return
     
-    success = db.complete_target(target_id)
+    updated = await db.complete_target(target_id)
+    invalidate_rendered(user_id)
     
-    if success:
+    if updated is not None:
         await update.message.reply_text(
             f"🎉 Target marked as completed!\n"
-            f"Target ID: {target_id[:8]}..."
+            f"Target ID: {str(target_id)[:8]}..."
         )
     else:
         await update.message.reply_text("❌ Target not found.")
 
+@requires_registration
 async def view_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    stats = db.get_user_stats(user_id)
-    
     today = date.today()
-    daily_status = db.get_user_daily_status(user_id, today)
+    
+    # Only the target statistics are cached, and only for the day they were rendered;
+    # today's attendance changes without a target write, so it is read every time
+    cached = rendered_stats.get(user_id)
+    if cached is not None and cached[0] == today:
+        stats_text = cached[1]
+        daily_status = await db.get_user_daily_status(user_id, today)
+    else:
+        stats, daily_status = await asyncio.gather(
+            db.get_user_stats(user_id),
+            db.get_user_daily_status(user_id, today)
+        )
+        stats_text = (
+            f"📊 Study Statistics for @{display_name(update.effective_user)}\n\n"
+            f"🎯 Total Targets: {stats['total_targets']}\n"
+            f"✅ Completed: {stats['completed_targets']}\n"
+            f"⏳ Active: {stats['active_targets']}\n"
+            f"📈 Completion Rate: {stats['completion_rate']}%\n"
+            f"🔥 Current Streak: {stats['current_streak']} days\n"
+            f"🏆 Best Streak: {stats['best_streak']} days\n\n"
+        )
+        rendered_stats[user_id] = (today, stats_text)
     
     attendance_status = "✅ Present" if daily_status["has_target"] else "❌ No target yet"
     if daily_status["marked_absent"]:
         attendance_status = "🚫 Absent"
     
     message = (
-        f"📊 Study Statistics for @{update.effective_user.username or update.effective_user.first_name}\n\n"
-        f"🎯 Total Targets: {stats['total_targets']}\n"
-        f"✅ Completed: {stats['completed_targets']}\n"
-        f"⏳ Active: {stats['active_targets']}\n"
-        f"📈 Completion Rate: {stats['completion_rate']}%\n"
-        f"🔥 Current Streak: {stats['current_streak']} days\n"
-        f"🏆 Best Streak: {stats['best_streak']} days\n\n"
+        f"{stats_text}"
         f"📅 **Today's Status ({today.strftime('%Y-%m-%d')}):**\n"
         f"• Attendance: {attendance_status}\n"
         f"• Reminders: {len(daily_status['notifications_sent'])}/4\n"
@@ -1159,55 +1218,42 @@ async def view_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(message)
 
+@requires_registration
 async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         await update.message.reply_text("This command is for admins only.")
         return
     
-    data = db.export_all_data()
+    # The whole CSV is held in memory and sent as one upload; documents are
+    # streamed from the cursor, so only the rendered rows accumulate
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    total = 0
+    try:
+        async for document in db.export_all_data():
+            writer.writerow([document.get(field, "") for field in EXPORT_FIELDS])
+            total += 1
+    except Exception as e:
+        logger.error(f"Error exporting data after {total} records: {e}")
+        await update.message.reply_text(
+            f"❌ Data export failed after {total} records. Please try again."
+        )
+        return
     
-    await update.message.reply_text(
-        "📊 Data export initiated.\n"
-        f"Total records: {len(data)}\n\n"
-        "Note: In production, this would generate and send a file."
+    await update.message.reply_document(
+        buffer.getvalue().encode("utf-8"),
+        filename=f"targets_{date.today().isoformat()}.csv",
+        caption=f"📊 Data export complete.\nTotal records: {total}"
     )
 
+@requires_registration
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "📚 Study Bot Help\n\n"
-        "**Daily Target System:**\n"
-        "• 9 AM: First reminder\n"
-        "• 12 PM: Second reminder\n"
-        "• 3 PM: Third reminder\n"
-        "• 5 PM: Final reminder & absent marking\n\n"
-        "**Commands:**\n"
-        "/start - Start the bot\n"
-        "/settarget <description> - Set a new study target\n"
-        "/mytargets - View your current targets\n"
-        "/progress <id> <percentage> - Update target progress\n"
-        "/completed <id> - Mark target as completed\n"
-        "/stats - View your study statistics\n"
-        "/dailystatus - Check your daily attendance status\n"
-        "/attendance - Admin: View daily attendance report\n"
-        "/export - Admin: Export all data (admin only)\n"
-        "/checkmembers - Admin: Check and register existing members\n"
-        "/registeruser - Admin: Manually register a user\n"
-        "/help - Show this help message\n\n"
-        "**Tips:**\n"
-        "• Set realistic targets\n"
-        "• Update progress regularly\n"
-        "• Upload daily target before 5 PM\n"
-        "• Use partial target IDs (first 8 characters) for commands"
-    )
-    
-    await update.message.reply_text(help_text)
+    await update.message.reply_text(HELP_TEXT)
 
 # Admin command to manually register users
 async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin command to manually register a user"""
-    if not is_allowed_group(update.effective_chat.id):
-        return
-    
     if not is_admin(update.effective_user.id):
         await update.message.reply_text("This command is for admins only.")
         return
@@ -1221,18 +1267,18 @@ async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         if update.message.reply_to_message:
             user_id = update.message.reply_to_message.from_user.id
-            username = update.message.reply_to_message.from_user.username or update.message.reply_to_message.from_user.first_name
+            username = display_name(update.message.reply_to_message.from_user)
         else:
             user_id = int(context.args[0])
             username = context.args[1] if len(context.args) > 1 else "Unknown"
         
-        if db.is_user_registered(user_id, update.effective_chat.id):
+        if await db.is_user_registered(user_id, update.effective_chat.id):
             await update.message.reply_text(
                 f"✅ User @{username} (ID: {user_id}) is already registered."
             )
             return
         
-        success = db.accept_rules(user_id, update.effective_chat.id)
+        success = await db.accept_rules(user_id, update.effective_chat.id)
         
         if success:
             await unmute_user(update.effective_chat.id, user_id, context)
@@ -1253,7 +1299,7 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.effective_chat.send_message(
                 "An error occurred. Please try again later."
             )
-        except:
+        except TelegramError:
             pass
 
 # Setup job queue for daily reminders
@@ -1267,7 +1313,9 @@ def setup_job_queue(application):
             job_queue.run_daily(
                 send_daily_reminders,
                 time=datetime.strptime(f"{hour:02d}:00", "%H:%M").time(),
-                days=(0, 1, 2, 3, 4, 5, 6)
+                days=(0, 1, 2, 3, 4, 5, 6),
+                data=NOTIFICATION_TYPES[hour],
+                name=f"reminder_{hour}"
             )
             logger.info(f"Scheduled daily reminder at {hour}:00")
         
@@ -1280,46 +1328,8 @@ def send_heartbeat():
     """Send periodic heartbeat to keep the bot alive"""
     while True:
         bot_status["last_heartbeat"] = datetime.now()
-        global deadline_callbacks
-        if len(deadline_callbacks) > 100:
-            keys = list(deadline_callbacks.keys())[:50]
-            for key in keys:
-                del deadline_callbacks[key]
         time.sleep(300)
 
-# Start Flask server in a separate thread
-def start_flask():
-    """Start Flask server for health checks"""
-    app.run(host='0.0.0.0', port=PORT)
-
-# Wrapper functions for commands
-async def set_target_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, set_target)
-
-async def my_targets_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, my_targets)
-
-async def update_progress_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, update_progress)
-
-async def mark_completed_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, mark_completed)
-
-async def view_stats_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, view_stats)
-
-async def daily_status_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, daily_status)
-
-async def attendance_report_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, attendance_report)
-
-async def export_data_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, export_data)
-
-async def help_command_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await check_registration_and_execute(update, context, help_command)
-
 # Test command for manual reminder trigger
 async def test_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Test command to trigger reminders manually (admin only)"""
@@ -1387,6 +1397,30 @@ async def test_mute(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text("❌ Mute test failed. Check logs for details.")
 
+# Prepare the database inside the bot's event loop
+async def post_init(application: Application):
+    """Run async setup before the bot starts polling"""
+    await db.setup()
+    # Health probes are answered on the bot's own event loop, no extra thread
+    application.bot_data["health_server"] = await start_health_server('0.0.0.0', HEALTH_PORT)
+    # Push registration changes into the caches instead of waiting for TTLs;
+    # the watcher never returns on its own, so keep it out of Application.stop()
+    # and cancel it in post_shutdown instead
+    application.bot_data["registration_watcher"] = asyncio.create_task(db.watch_registrations())
+
+async def post_shutdown(application: Application):
+    """Stop the background tasks started in post_init"""
+    watcher = application.bot_data.pop("registration_watcher", None)
+    if watcher is not None:
+        watcher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await watcher
+    
+    health_server = application.bot_data.pop("health_server", None)
+    if health_server is not None:
+        health_server.close()
+        await health_server.wait_closed()
+
 # Main function
 def main():
     bot_status["is_running"] = True
@@ -1396,47 +1430,64 @@ def main():
     heartbeat_thread = threading.Thread(target=send_heartbeat, daemon=True)
     heartbeat_thread.start()
     
-    flask_thread = threading.Thread(target=start_flask, daemon=True)
-    flask_thread.start()
-    
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    # concurrent_updates lets one handler's Mongo/Telegram waits overlap with the next update;
+    # the outbound pool is sized to match so replies don't queue for a connection
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(True)
+        .connection_pool_size(256)
+        .pool_timeout(30)
+        .get_updates_connection_pool_size(2)
+        # Shape outbound calls to Telegram's flood limits instead of eating 429s
+        .rate_limiter(AIORateLimiter(
+            overall_max_rate=30, overall_time_period=1,
+            group_max_rate=20, group_time_period=60,
+            max_retries=3
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     setup_job_queue(application)
     
     # Add handlers - ORDER IS IMPORTANT!
+    # Group-only handlers are filtered by chat at dispatch time
+    in_group = filters.Chat(ALLOWED_GROUP_ID)
     
     # 1. First handle new members
     application.add_handler(MessageHandler(
-        filters.StatusUpdate.NEW_CHAT_MEMBERS, 
+        filters.StatusUpdate.NEW_CHAT_MEMBERS & in_group,
         new_member_handler
     ))
     
     # 2. Handle all non-command messages to check registration
     application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND & filters.ChatType.GROUPS,
+        filters.TEXT & ~filters.COMMAND & in_group,
         check_and_mute_unregistered
     ))
     
     # 3. Add command handlers
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("checkmembers", check_existing_members))
-    application.add_handler(CommandHandler("settarget", set_target_wrapper))
-    application.add_handler(CommandHandler("mytargets", my_targets_wrapper))
-    application.add_handler(CommandHandler("progress", update_progress_wrapper))
-    application.add_handler(CommandHandler("completed", mark_completed_wrapper))
-    application.add_handler(CommandHandler("stats", view_stats_wrapper))
-    application.add_handler(CommandHandler("dailystatus", daily_status_wrapper))
-    application.add_handler(CommandHandler("attendance", attendance_report_wrapper))
-    application.add_handler(CommandHandler("export", export_data_wrapper))
-    application.add_handler(CommandHandler("help", help_command_wrapper))
+    application.add_handler(CommandHandler("checkmembers", check_existing_members, filters=in_group))
+    application.add_handler(CommandHandler("settarget", set_target, filters=in_group))
+    application.add_handler(CommandHandler("mytargets", my_targets, filters=in_group))
+    application.add_handler(CommandHandler("progress", update_progress, filters=in_group))
+    application.add_handler(CommandHandler("completed", mark_completed, filters=in_group))
+    application.add_handler(CommandHandler("stats", view_stats, filters=in_group))
+    application.add_handler(CommandHandler("dailystatus", daily_status, filters=in_group))
+    application.add_handler(CommandHandler("attendance", attendance_report, filters=in_group))
+    application.add_handler(CommandHandler("export", export_data, filters=in_group))
+    application.add_handler(CommandHandler("help", help_command, filters=in_group))
     application.add_handler(CommandHandler("testreminder", test_reminder))
     application.add_handler(CommandHandler("botstatus", bot_status_command))
     application.add_handler(CommandHandler("testmute", test_mute))
-    application.add_handler(CommandHandler("registeruser", register_user))
+    application.add_handler(CommandHandler("registeruser", register_user, filters=in_group))
     
     # 4. Callback handlers
-    application.add_handler(CallbackQueryHandler(deadline_callback, pattern="^deadline_"))
-    application.add_handler(CallbackQueryHandler(accept_rules_callback, pattern="^accept_rules_"))
+    application.add_handler(CallbackQueryHandler(deadline_callback, pattern=DEADLINE_PATTERN))
+    application.add_handler(CallbackQueryHandler(accept_rules_callback, pattern=ACCEPT_RULES_PATTERN))
     
     # 5. Error handler
     application.add_error_handler(error_handler)
@@ -1447,7 +1498,8 @@ def main():
     print(f"📱 Bot User ID: {TELEGRAM_TOKEN.split(':')[0]}")
     print(f"🌐 Allowed Group ID: {ALLOWED_GROUP_ID}")
     print(f"👑 Admin User ID: {ADMIN_USER_ID}")
-    print(f"🌐 Flask server running on port {PORT}")
+    print(f"🌐 Health check server on port {HEALTH_PORT}")
+    print(f"📡 Updates via: {'webhook on port ' + str(PORT) if WEBHOOK_URL else 'long polling'}")
     print(f"⏰ Daily reminders at: {', '.join(str(h) + ':00' for h in NOTIFICATION_TIMES)}")
     print("\n⚠️ **CRITICAL:** Make sure bot is ADMIN in your group!")
     print("   Use /botstatus to check admin permissions")
@@ -1460,11 +1512,27 @@ def main():
     print("=" * 60)
     
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
-            close_loop=False
-        )
+        if WEBHOOK_URL:
+            # Telegram pushes each update as it happens; no idle getUpdates calls
+            application.run_webhook(
+                listen='0.0.0.0',
+                port=PORT,
+                url_path=TELEGRAM_TOKEN,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{TELEGRAM_TOKEN}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=True,
+                close_loop=False
+            )
+        else:
+            # A 30s long poll keeps one getUpdates open instead of re-polling every 10s
+            application.run_polling(
+                poll_interval=0.0,
+                timeout=30,
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=True,
+                close_loop=False
+            )
     except KeyboardInterrupt:
         print("\nBot stopped by user")
     except Exception as e: